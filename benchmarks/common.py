@@ -0,0 +1,151 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import poetics.config as config
+import poetics.lookups as lookups
+from poetics.classes.metrics import Metrics
+
+# Directory that results and baselines are kept in by default.
+directory = os.path.dirname(__file__)
+# Analyses timed by the benchmarks, in the order they're run (each after those it depends on).
+stages = ['rhyme', 'pos', 'scansion', 'meter', 'form', 'sonic', 'sight']
+# Default fraction by which a result may be worse than its baseline before it counts as a regression.
+default_threshold = 0.1
+
+
+# Returns an argument parser with the options shared by all benchmarks: where to write results, the baseline to compare
+# against (and whether to replace it with these results), and the regression threshold.
+def get_parser(name, description):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.' + name, description=description)
+    parser.add_argument('--output', default=os.path.join(directory, 'results', name + '.json'),
+                        help="file to write results to (default: %(default)s)")
+    parser.add_argument('--baseline', default=os.path.join(directory, 'baselines', name + '.json'),
+                        help="results to compare against, if the file exists (default: %(default)s)")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--threshold', type=float, default=default_threshold,
+                        help="fraction by which a result may be worse than the baseline (default: %(default)s)")
+    parser.add_argument('--log', action='store_true', help="keep poetics' logging on while benchmarking")
+    return parser
+
+
+# Returns a list of stages from a comma separated string.
+def stage_list(value):
+    chosen = [stage.strip() for stage in value.split(',') if stage.strip()]
+    unknown = [stage for stage in chosen if stage not in config.poem_outputs]
+    if unknown:
+        raise argparse.ArgumentTypeError("unknown stage(s) %s (valid stages are %s)"
+                                         % (', '.join(unknown), ', '.join(stages)))
+    return chosen
+
+
+# Turns off poetics' logging (which would otherwise dominate the timings), unless log is True.
+def set_logging(log=False):
+    if log:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(message)s', datefmt='%H:%M:%S')
+    else:
+        logging.disable(logging.CRITICAL)
+
+
+# Clears the caches of the meter and form lookups and the expanded repeating form schemes, so that every round of a
+# benchmark starts cold, and collects garbage. The lexicon (including the lazily loaded rhyme index and word trie) stays
+# loaded.
+def reset():
+    for function in Metrics.cached_functions:
+        function.cache_clear()
+    with lookups.repeating_rhyme_lock:
+        lookups.repeating_rhyme_cache.clear()
+    gc.collect()
+
+
+# Returns the number of non-blank lines and word tokens of a poem.
+def count_poem(poem):
+    return len([line for line in poem.lines if not line.is_blank]), len(poem.word_tokens)
+
+
+# Runs a stage (one of stages) on a poem.
+def run_stage(poem, stage):
+    getattr(poem, config.poem_outputs[stage])()
+
+
+# Runs function and returns (peak bytes, retained bytes, result), where peak is the most allocated while it ran and
+# retained is what was still allocated once it returned, both above what was allocated before it ran. Starts tracemalloc
+# if it isn't already tracing.
+def trace(function, *args):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    return peak - before, current - before, result
+
+
+# Runs function and returns the bytes allocated at its peak (see trace), along with its result.
+def trace_peak(function, *args):
+    peak, retained, result = trace(function, *args)
+    return peak, result
+
+
+# Returns a description of the machine and interpreter that results were measured on.
+def get_environment():
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'platform': platform.platform(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+# Writes results to path as json, creating its directory if needed.
+def write_results(path, results):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding="utf-8") as file:
+        json.dump(results, file, indent=1, sort_keys=True)
+
+
+# Compares results with the baseline results at path, for each of the given metrics (where lower values are better) of
+# each entry of results['stages']. Prints the comparison and returns a list of (stage, metric, value, baseline value)
+# for each value that is worse than its baseline by more than threshold. Returns an empty list if there's no baseline.
+def compare_to_baseline(results, path, metrics, threshold=default_threshold):
+    if not os.path.isfile(path):
+        print('No baseline at %s.' % path)
+        return []
+    with open(path, encoding="utf-8") as file:
+        baseline = json.load(file)
+    if baseline.get('environment', {}).get('machine') != results['environment']['machine']:
+        print('Warning: the baseline was measured on a different machine.')
+
+    regressions = []
+    print('\n%-24s %-16s %14s %14s %8s' % ('stage', 'metric', 'baseline', 'result', 'change'))
+    for stage, values in results['stages'].items():
+        for metric in metrics:
+            old = baseline['stages'].get(stage, {}).get(metric)
+            new = values.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            regressed = change > threshold
+            print('%-24s %-16s %14.6g %14.6g %+7.1f%%%s' % (stage, metric, old, new, change * 100,
+                                                            '  REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append((stage, metric, new, old))
+    return regressions
+
+
+# Writes results, compares them with the baseline and stores them as the baseline if asked to, then exits with status 1
+# if any of the metrics regressed.
+def finish(args, results, metrics):
+    write_results(args.output, results)
+    print('\nResults written to %s.' % args.output)
+    regressions = compare_to_baseline(results, args.baseline, metrics, args.threshold)
+    if args.save_baseline:
+        write_results(args.baseline, results)
+        print('Baseline written to %s.' % args.baseline)
+    if regressions:
+        print('\n%s regression(s) of more than %.0f%%.' % (len(regressions), args.threshold * 100))
+        sys.exit(1)
@@ -0,0 +1,175 @@
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import poetics.config as config
+from poetics.classes.poem import Poem
+from poetics.lookups import get_word_trie, load_rhyme_index
+from poetics.poetics import get_poem_files
+
+from benchmarks.common import stages, get_parser, set_logging, reset, count_poem, run_stage, trace, get_environment, \
+    finish
+from benchmarks.synthetic import generate_poem, int_list
+
+# Number of allocation sites listed.
+top_sites = 20
+# Frames kept for each allocation while tracing imports, enough to find the line of config.py that led to it.
+import_frames = 64
+
+# Measures importing poetics in a fresh interpreter, printing json: the seconds taken and the resident memory before and
+# after. If run with the argument 'trace', allocations are traced, and the bytes still allocated are also printed, in
+# total and by the line of poetics/config.py (where the lexicon and models are loaded) that they were allocated under.
+import_script = '''
+import json, os, sys, time
+
+def get_rss():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+tracing = sys.argv[1:] == ['trace']
+if tracing:
+    import tracemalloc
+    tracemalloc.start(%s)
+rss = get_rss()
+start = time.perf_counter()
+import poetics
+result = {'seconds': time.perf_counter() - start, 'rss_before': rss, 'rss_after': get_rss()}
+if tracing:
+    import linecache
+    config_file = poetics.config.__file__
+    snapshot = tracemalloc.take_snapshot()
+    result['traced_bytes'] = sum([trace.size for trace in snapshot.traces])
+    lines = {}
+    for trace in snapshot.traces:
+        for frame in trace.traceback:
+            if frame.filename == config_file:
+                lines[frame.lineno] = lines.get(frame.lineno, 0) + trace.size
+                break
+    result['config_lines'] = [['config.py:%%s %%s' %% (lineno, linecache.getline(config_file, lineno).strip()), size]
+                              for lineno, size in sorted(lines.items(), key=lambda item: item[1], reverse=True)]
+print(json.dumps(result))
+''' % import_frames
+
+
+# Runs import_script in a fresh interpreter (with allocations traced if tracing is True) and returns its results.
+def measure_import(tracing=False):
+    output = subprocess.check_output([sys.executable, '-c', import_script] + (['trace'] if tracing else []),
+                                     cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+# Returns the bytes retained by loading the lazily loaded lexicons (the rhyme index and the word trie).
+def measure_lazy_lexicons():
+    return {'rhyme_index': trace(load_rhyme_index)[1], 'word_trie': trace(get_word_trie)[1]}
+
+
+# Analyzes each of texts ([(name, lines)]) with every stage, keeping every poem, and returns (results by stage, lines,
+# snapshot statistics of what the poems retained). For each stage, peak_bytes is the largest peak of any poem and
+# retained_bytes is the total retained across poems. Expects tracemalloc to be tracing.
+def measure_stages(texts, analyses):
+    results = {stage: {'peak_bytes': 0, 'retained_bytes': 0} for stage in ['construction'] + analyses}
+    poems = []
+    lines = 0
+    reset()
+    before = tracemalloc.take_snapshot()
+    for name, text in texts:
+        peak, retained, poem = trace(Poem, text, name, 'Benchmark')
+        results['construction']['peak_bytes'] = max(results['construction']['peak_bytes'], peak)
+        results['construction']['retained_bytes'] += retained
+        for stage in analyses:
+            peak, retained, result = trace(run_stage, poem, stage)
+            results[stage]['peak_bytes'] = max(results[stage]['peak_bytes'], peak)
+            results[stage]['retained_bytes'] += retained
+        lines += count_poem(poem)[0]
+        poems.append(poem)
+    statistics = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+    return results, lines, statistics
+
+
+# Returns [(name, lines)] for the poems in directory, or, if any sizes (in lines) are given, for a poem of each size
+# generated from the lines of the poems in directory.
+def get_texts(directory, sizes=None):
+    if sizes:
+        return [('Synthetic %s' % size, generate_poem(size, directory=directory).splitlines(True)) for size in sizes]
+    texts = []
+    for file in get_poem_files(directory):
+        with open(os.path.join(directory, file), encoding="utf-8") as poem:
+            texts.append((file, poem.readlines()))
+    return texts
+
+
+# Prints import, lexicon and per stage memory, and the top allocation sites of analyzed poems.
+def print_results(results):
+    megabyte = 2 ** 20
+    imported = results['import']
+    print('Import: %.2fs, RSS %.1fMB -> %.1fMB, %.1fMB traced' % (imported['seconds'], imported['rss_before'] / megabyte,
+                                                                imported['rss_after'] / megabyte,
+                                                                imported['traced_bytes'] / megabyte))
+    print('\nLexicon (bytes retained)')
+    for name, size in results['lexicon'].items():
+        print('  %-72s %8.1fMB' % (name[:72], size / megabyte))
+    print('\n%s poems, %s lines' % (results['corpus']['poems'], results['corpus']['lines']))
+    print('%-14s %12s %14s %16s' % ('stage', 'peak MB', 'retained MB', 'retained B/line'))
+    for stage, values in results['stages'].items():
+        if 'retained_bytes' in values:
+            print('%-14s %12s %14.2f %16s' % (stage, '%.2f' % (values['peak_bytes'] / megabyte)
+                                              if 'peak_bytes' in values else '',
+                                              values['retained_bytes'] / megabyte, values['retained_per_line']))
+    print('\nTop allocation sites retained by analyzed poems')
+    for site in results['sites']:
+        print('  %-60s %10.1fKB %9s blocks' % (site['site'][-60:], site['bytes'] / 1024, site['blocks']))
+
+
+def main(argv=None):
+    parser = get_parser('memory', "Measures import-time memory, the lexicon's footprint, and the peak and retained "
+                                  "memory of each stage of analysis.")
+    parser.add_argument('directory', nargs='?', default=config.poem_directory,
+                        help="corpus to measure, or to draw generated poems' lines from (default: the bundled poems)")
+    parser.add_argument('--synthetic', type=int_list, metavar='SIZES',
+                        help="measure generated poems of these comma separated sizes (in lines) instead of a corpus")
+    args = parser.parse_args(argv)
+    set_logging(args.log)
+
+    imported = measure_import()
+    traced_import = measure_import(tracing=True)
+    imported['traced_bytes'] = traced_import['traced_bytes']
+    results = {'benchmark': 'memory', 'environment': get_environment(), 'import': imported,
+               'lexicon': dict(traced_import['config_lines'][:10]),
+               'stages': {'import': {'rss_bytes': imported['rss_after'], 'traced_bytes': imported['traced_bytes']}}}
+
+    tracemalloc.start()
+    results['lexicon'].update(measure_lazy_lexicons())
+    texts = get_texts(args.directory, args.synthetic)
+    # Warm up (spaCy's lazy initialization, etc.) so that it isn't counted against the first poem.
+    if texts:
+        poem = Poem(list(texts[0][1]), 'Warm Up', 'Benchmark')
+        for stage in stages:
+            run_stage(poem, stage)
+        del poem
+    stage_results, lines, statistics = measure_stages(texts, stages)
+    tracemalloc.stop()
+
+    results['corpus'] = {'directory': os.path.abspath(args.directory),
+                         'synthetic': args.synthetic, 'poems': len(texts), 'lines': lines}
+    for stage, values in stage_results.items():
+        values['retained_per_line'] = round(values['retained_bytes'] / lines, 1) if lines else None
+        results['stages'][stage] = values
+    retained = sum([statistic.size_diff for statistic in statistics])
+    results['stages']['total'] = {'retained_bytes': retained,
+                                  'retained_per_line': round(retained / lines, 1) if lines else None}
+    results['sites'] = [{'site': '%s:%s' % (statistic.traceback[0].filename, statistic.traceback[0].lineno),
+                         'bytes': statistic.size_diff, 'blocks': statistic.count_diff}
+                        for statistic in sorted(statistics, key=lambda statistic: statistic.size_diff,
+                                                reverse=True)[:top_sites]]
+    print_results(results)
+    finish(args, results, ['rss_bytes', 'traced_bytes', 'peak_bytes', 'retained_per_line'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import math
+import time
+import tracemalloc
+
+import poetics.config as config
+from poetics.classes.poem import Poem
+from poetics.lookups import get_word_trie
+
+from benchmarks.common import stages, get_parser, set_logging, reset, run_stage, trace_peak, get_environment, finish, \
+    stage_list
+from benchmarks.synthetic import generate_poem, int_list
+
+# Scaling exponent (of time or memory against lines) above which a stage is flagged as superlinear.
+superlinear_exponent = 1.3
+
+
+# Analyzes text with each stage in turn, returning {stage: seconds}, or {stage: peak bytes} if trace is True.
+# 'construction' is the creation of the Poem.
+def run_stages(text, analyses, trace=False):
+    results = {}
+    reset()
+    if trace:
+        results['construction'], poem = trace_peak(Poem, text.splitlines(True), 'Synthetic', 'Poetics')
+    else:
+        start = time.perf_counter()
+        poem = Poem(text.splitlines(True), 'Synthetic', 'Poetics')
+        results['construction'] = time.perf_counter() - start
+    for stage in analyses:
+        if trace:
+            results[stage] = trace_peak(run_stage, poem, stage)[0]
+        else:
+            start = time.perf_counter()
+            run_stage(poem, stage)
+            results[stage] = time.perf_counter() - start
+    return results
+
+
+# Returns the exponent k of value ~ size^k between the two largest sizes that have values, or None.
+def get_exponent(sizes, values):
+    points = [(size, value) for size, value in zip(sizes, values) if value]
+    if len(points) < 2:
+        return None
+    (size1, value1), (size2, value2) = points[-2:]
+    return round(math.log(value2 / value1) / math.log(size2 / size1), 2)
+
+
+# Times each stage on generated poems of each of sizes (in lines), then measures each stage's peak memory with
+# tracemalloc in a separate pass (as tracing slows everything down). Sizes after one whose timing pass took longer than
+# budget seconds are skipped. Returns results, with values for each stage at each size under
+# results['stages']['<stage>/<size>'], and the scaling exponents of each stage under results['exponents'].
+def run_scaling(sizes, analyses, generator_args, budget):
+    results = {'benchmark': 'scaling', 'environment': get_environment(), 'generator': generator_args,
+               'sizes': [], 'stages': {}, 'exponents': {}}
+    for size in sizes:
+        text = generate_poem(size, **generator_args)
+        start = time.perf_counter()
+        seconds = run_stages(text, analyses)
+        elapsed = time.perf_counter() - start
+        peaks = run_stages(text, analyses, trace=True)
+        tracemalloc.stop()
+        results['sizes'].append(size)
+        for stage in seconds:
+            results['stages']['%s/%s' % (stage, size)] = {'seconds': round(seconds[stage], 6),
+                                                          'peak_bytes': peaks[stage],
+                                                          'lines_per_sec': round(size / seconds[stage], 1)
+                                                          if seconds[stage] else None}
+        print('%7s lines: %s' % (size, ', '.join(['%s %.3fs %.1fMB' % (stage, seconds[stage], peaks[stage] / 2 ** 20)
+                                                  for stage in seconds])))
+        if elapsed > budget:
+            print('Skipping sizes after %s lines (took %.0fs, over the %ss budget).' % (size, elapsed, budget))
+            break
+
+    for stage in ['construction'] + analyses:
+        values = [results['stages']['%s/%s' % (stage, size)] for size in results['sizes']]
+        results['exponents'][stage] = {'seconds': get_exponent(results['sizes'], [value['seconds'] for value in values]),
+                                       'peak_bytes': get_exponent(results['sizes'],
+                                                                  [value['peak_bytes'] for value in values])}
+    return results
+
+
+# Prints the scaling exponent of each stage, flagging those that grow faster than linearly.
+def print_exponents(results):
+    print('\n%-14s %14s %14s' % ('stage', 'time exponent', 'memory exponent'))
+    for stage, exponents in results['exponents'].items():
+        flagged = [exponent for exponent in exponents.values() if exponent and exponent > superlinear_exponent]
+        print('%-14s %14s %14s%s' % (stage, exponents['seconds'], exponents['peak_bytes'],
+                                     '  SUPERLINEAR' if flagged else ''))
+
+
+# Plots runtime and peak memory against size for every stage (log-log) to path. Requires matplotlib, which isn't
+# otherwise needed, so the plot is skipped if it isn't installed.
+def plot(results, path):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as pyplot
+    except ImportError:
+        print('matplotlib is not installed, so no plot was written.')
+        return
+    figure, (time_axes, memory_axes) = pyplot.subplots(1, 2, figsize=(12, 5))
+    for stage in results['exponents']:
+        sizes = [size for size in results['sizes'] if '%s/%s' % (stage, size) in results['stages']]
+        values = [results['stages']['%s/%s' % (stage, size)] for size in sizes]
+        time_axes.plot(sizes, [value['seconds'] for value in values], marker='o', label=stage)
+        memory_axes.plot(sizes, [value['peak_bytes'] / 2 ** 20 for value in values], marker='o', label=stage)
+    for axes, label in [(time_axes, 'seconds'), (memory_axes, 'peak MB')]:
+        axes.set_xscale('log')
+        axes.set_yscale('log')
+        axes.set_xlabel('lines')
+        axes.set_ylabel(label)
+    time_axes.legend()
+    figure.tight_layout()
+    figure.savefig(path)
+    print('Plot written to %s.' % path)
+
+
+def main(argv=None):
+    parser = get_parser('scaling', "Times and measures the peak memory of each stage of analysis on synthetic poems "
+                                   "of increasing size.")
+    parser.add_argument('--sizes', type=int_list, default=[10, 100, 1000, 10000],
+                        help="comma separated poem sizes, in lines (default: 10,100,1000,10000)")
+    parser.add_argument('--stages', type=stage_list, default=stages,
+                        help="comma separated stages (default: %s)" % ','.join(stages))
+    parser.add_argument('--stanzas', type=int_list, default=[4], help="comma separated stanza lengths (default: 4)")
+    parser.add_argument('--scheme', default='abab', help="rhyme scheme of each stanza (default: abab)")
+    parser.add_argument('--oov-rate', type=float, default=0.02, help="fraction of words made up (default: 0.02)")
+    parser.add_argument('--contraction-rate', type=float, default=0.1,
+                        help="fraction of contractible words contracted (default: 0.1)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--source', default=config.poem_directory, help="poems to draw lines from")
+    parser.add_argument('--budget', type=float, default=600,
+                        help="seconds a size may take before larger sizes are skipped (default: 600)")
+    parser.add_argument('--plot', metavar='PNG', help="plot time and memory against size to PNG (needs matplotlib)")
+    args = parser.parse_args(argv)
+    set_logging(args.log)
+
+    generator_args = {'stanzas': args.stanzas, 'scheme': args.scheme, 'oov_rate': args.oov_rate,
+                      'contraction_rate': args.contraction_rate, 'seed': args.seed, 'directory': args.source}
+    # Warm up (spaCy, the word trie) so that loading isn't counted against the smallest size.
+    get_word_trie()
+    run_stages(generate_poem(10, **generator_args), args.stages)
+
+    results = run_scaling(args.sizes, args.stages, generator_args, args.budget)
+    print_exponents(results)
+    if args.plot:
+        plot(results, args.plot)
+    finish(args, results, ['seconds', 'peak_bytes'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import time
+
+import poetics.config as config
+from poetics.poetics import create_poem, get_poem_files, process_poems
+
+from benchmarks.common import stages, get_parser, set_logging, reset, count_poem, run_stage, get_environment, finish
+
+
+# Times create_poem and each stage over every poem in directory, repeat times, and returns ({stage: seconds}, poems,
+# lines, tokens), where seconds is the fastest round's total for the stage.
+def time_stages(directory, repeat=3):
+    files = get_poem_files(directory)
+    best = {}
+    lines = tokens = 0
+    for round_number in range(repeat):
+        reset()
+        times = dict.fromkeys(['create_poem'] + stages, 0.0)
+        lines = tokens = 0
+        for file in files:
+            start = time.perf_counter()
+            poem = create_poem(file, directory=directory)
+            times['create_poem'] += time.perf_counter() - start
+            for stage in stages:
+                start = time.perf_counter()
+                run_stage(poem, stage)
+                times[stage] += time.perf_counter() - start
+            poem_lines, poem_tokens = count_poem(poem)
+            lines += poem_lines
+            tokens += poem_tokens
+        for stage, seconds in times.items():
+            best[stage] = min(best.get(stage, seconds), seconds)
+    return best, len(files), lines, tokens
+
+
+# Times process_poems (analyzing and recording every poem in directory, with all stages) repeat times, and returns the
+# fastest round's seconds.
+def time_process_poems(directory, repeat=3, jobs=None):
+    best = None
+    for round_number in range(repeat):
+        reset()
+        with tempfile.TemporaryDirectory() as temp:
+            start = time.perf_counter()
+            process_poems(directory, os.path.join(temp, 'output.csv'), jobs=jobs, incremental=False, outputs=stages)
+            seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+# Returns benchmark results for seconds per stage, over a corpus of the given numbers of poems, lines and tokens.
+def get_results(times, directory, poems, lines, tokens, repeat):
+    results = {'benchmark': 'stages', 'environment': get_environment(), 'repeat': repeat,
+               'corpus': {'directory': os.path.abspath(directory), 'poems': poems, 'lines': lines, 'tokens': tokens},
+               'stages': {}}
+    for stage, seconds in times.items():
+        results['stages'][stage] = {'seconds': round(seconds, 6),
+                                    'lines_per_sec': round(lines / seconds, 1) if seconds else None,
+                                    'tokens_per_sec': round(tokens / seconds, 1) if seconds else None}
+    return results
+
+
+# Prints the seconds and throughput of each stage.
+def print_results(results):
+    corpus = results['corpus']
+    print('%s poems, %s lines, %s tokens (best of %s)' % (corpus['poems'], corpus['lines'], corpus['tokens'],
+                                                          results['repeat']))
+    print('%-16s %10s %12s %12s' % ('stage', 'seconds', 'lines/sec', 'tokens/sec'))
+    for stage, values in results['stages'].items():
+        print('%-16s %10.3f %12s %12s' % (stage, values['seconds'], values['lines_per_sec'], values['tokens_per_sec']))
+
+
+def main(argv=None):
+    parser = get_parser('stages', "Times each stage of analysis over a corpus of poems.")
+    parser.add_argument('directory', nargs='?', default=config.poem_directory,
+                        help="corpus to benchmark (default: the bundled poems)")
+    parser.add_argument('--repeat', type=int, default=3, help="rounds to run, keeping the fastest (default: 3)")
+    parser.add_argument('--jobs', type=int, default=None, help="workers for the process_poems round")
+    args = parser.parse_args(argv)
+    set_logging(args.log)
+
+    # Warm up (spaCy's lazy initialization, imports, etc.) so that it isn't counted in the first round.
+    files = get_poem_files(args.directory)
+    if files:
+        poem = create_poem(files[0], directory=args.directory)
+        for stage in stages:
+            run_stage(poem, stage)
+
+    times, poems, lines, tokens = time_stages(args.directory, args.repeat)
+    times['process_poems'] = time_process_poems(args.directory, args.repeat, args.jobs)
+    results = get_results(times, args.directory, poems, lines, tokens, args.repeat)
+    print_results(results)
+    finish(args, results, ['seconds'])
+
+
+if __name__ == "__main__":
+    main()
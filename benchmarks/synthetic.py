@@ -0,0 +1,170 @@
+import argparse
+import os
+import random
+import string
+from collections import OrderedDict
+
+import poetics.config as config
+from poetics.conversions import tokenize
+from poetics.lookups import load_rhyme_index, rhyme_index
+from poetics.poetics import get_poem_files
+
+# Contractions and elisions substituted into lines, as {word: contracted form}. Words ending in "ed" are also elided
+# ("loved" -> "lov'd").
+contractions = OrderedDict([('it is', "'tis"), ('it was', "'twas"), ('over', "o'er"), ('never', "ne'er"),
+                            ('even', "e'en"), ('ever', "e'er"), ('heaven', "heav'n"), ('flowers', "flow'rs"),
+                            ('do not', "don't"), ('cannot', "can't"), ('i am', "i'm"), ('you are', "you're"),
+                            ('they are', "they're"), ('will not', "won't"), ('the', "th'"), ('upon', "'pon"),
+                            ('between', "'tween"), ('against', "'gainst")])
+# Letters that made-up (out of vocabulary) words are built from.
+onsets = ['b', 'bl', 'br', 'd', 'dr', 'f', 'fl', 'g', 'gl', 'gr', 'k', 'kl', 'm', 'n', 'p', 'pl', 'qu', 'sk', 'sp',
+          'str', 't', 'th', 'tw', 'v', 'z']
+nuclei = ['a', 'e', 'i', 'o', 'u', 'ai', 'ea', 'oo', 'ou', 'y']
+codas = ['', 'b', 'ck', 'g', 'lm', 'nd', 'ng', 'rk', 'rt', 'sk', 'th', 'x', 'zz']
+# Minimum number of words a rhyme class needs to be drawn from.
+min_rhyme_class = 4
+
+# Lines and words of the source poems and rhyme classes of the lexicon, loaded the first time they're needed.
+sources = {}
+
+
+# Loads the lines of the poems in directory and the lexicon's rhyme classes. Rhyme classes are the perfect rhyme classes
+# of the rhyme index if it has been built, and otherwise groups of wordlist words with the same final three letters.
+def load_sources(directory=config.poem_directory):
+    if sources.get('directory') == directory:
+        return sources
+    lines = []
+    for file in get_poem_files(directory):
+        with open(os.path.join(directory, file), encoding="utf-8") as poem:
+            lines.extend([line.strip() for line in poem if tokenize(line)])
+
+    with open(config.cmudict_wordlist_path, encoding="utf-8") as file:
+        words = sorted(set([word.strip() for word in file if word.strip().isalpha()]))
+    if load_rhyme_index():
+        classes = [sorted([word for word in rhyme_class if word.isalpha()])
+                   for key, rhyme_class in sorted(rhyme_index['p_rhyme'].items())]
+    else:
+        endings = OrderedDict()
+        for word in words:
+            if len(word) > 3:
+                endings.setdefault(word[-3:], []).append(word)
+        classes = list(endings.values())
+
+    sources.update({'directory': directory, 'lines': lines, 'words': words,
+                    'rhyme_classes': [rhyme_class for rhyme_class in classes if len(rhyme_class) >= min_rhyme_class]})
+    return sources
+
+
+# Returns a made-up word that isn't in the lexicon.
+def make_oov_word(rng, words):
+    while True:
+        word = ''.join([rng.choice(onsets) + rng.choice(nuclei) for syllable in range(rng.randint(1, 3))])
+        word += rng.choice(codas)
+        if word not in words:
+            return word
+
+
+# Returns line with contractions substituted for about rate of the words that can be contracted, and with rate of its
+# words ending in "ed" elided.
+def contract(line, rate, rng):
+    words = line.split(' ')
+    index = 0
+    out = []
+    while index < len(words):
+        word = words[index]
+        pair = ' '.join(words[index:index + 2]).lower()
+        if pair in contractions and rng.random() < rate:
+            out.append(contractions[pair])
+            index += 2
+            continue
+        if word.lower() in contractions and rng.random() < rate:
+            out.append(contractions[word.lower()])
+        elif len(word) > 4 and word.endswith('ed') and rng.random() < rate:
+            out.append(word[:-2] + "'d")
+        else:
+            out.append(word)
+        index += 1
+    return ' '.join(out)
+
+
+# Returns the text of a poem of line_count lines, the same for the same arguments. Lines are drawn from the poems in
+# directory, with the end of each replaced by a word that rhymes according to scheme (a string of letters, where 'x'
+# marks an unrhymed line), which restarts at each stanza. Stanzas take their lengths from stanzas in turn (e.g. [4] for
+# quatrains, or [8, 6] for alternating octaves and sestets). About oov_rate of the words are made up (so are out of the
+# lexicon) and contraction_rate of the words that can be contracted or elided are.
+def generate_poem(line_count, stanzas=(4,), scheme='abab', oov_rate=0.0, contraction_rate=0.0, seed=0,
+                  directory=config.poem_directory):
+    rng = random.Random('%s %s %s %s %s %s' % (line_count, list(stanzas), scheme, oov_rate, contraction_rate, seed))
+    loaded = load_sources(directory)
+    lines, words, rhyme_classes = loaded['lines'], loaded['words'], loaded['rhyme_classes']
+    word_set = set(words)
+    out = []
+    written = 0
+    stanza_index = 0
+    while written < line_count:
+        length = min(stanzas[stanza_index % len(stanzas)], line_count - written)
+        written += length
+        stanza_index += 1
+        # Each letter of the scheme gets its own rhyme class for the stanza, and its lines end with successive words of
+        # the class.
+        rhymes = {}
+        used = {}
+        for index in range(length):
+            letter = scheme[index % len(scheme)] if scheme else 'x'
+            line = contract(rng.choice(lines), contraction_rate, rng) if contraction_rate else rng.choice(lines)
+            line_words = line.split(' ')
+            if oov_rate:
+                line_words = [make_oov_word(rng, word_set) if rng.random() < oov_rate else word for word in line_words]
+            if letter != 'x':
+                if letter not in rhymes:
+                    rhymes[letter] = rng.sample(rng.choice(rhyme_classes), min_rhyme_class)
+                    used[letter] = 0
+                # Keep any punctuation that followed the replaced word.
+                trailing = ''.join([char for char in line_words[-1] if char in string.punctuation and char != "'"])
+                line_words[-1] = rhymes[letter][used[letter] % min_rhyme_class] + trailing[-1:]
+                used[letter] += 1
+            out.append(' '.join(line_words))
+        out.append('')
+    return '\n'.join(out).strip() + '\n'
+
+
+# Writes generated poems to directory, one for each of sizes (numbers of lines), named so that create_poem reads their
+# title and author. Returns the written paths.
+def write_corpus(directory, sizes, stanzas=(4,), scheme='abab', oov_rate=0.0, contraction_rate=0.0, seed=0,
+                 source_directory=config.poem_directory):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for size in sizes:
+        path = os.path.join(directory, 'synthetic %s lines-poetics.txt' % size)
+        with open(path, 'w', encoding="utf-8") as file:
+            file.write(generate_poem(size, stanzas, scheme, oov_rate, contraction_rate, seed, source_directory))
+        paths.append(path)
+    return paths
+
+
+# Returns a list of ints from a comma separated string.
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.synthetic',
+                                     description="Writes a deterministic corpus of synthetic poems.")
+    parser.add_argument('directory', help="directory to write poems to")
+    parser.add_argument('--sizes', type=int_list, default=[10, 100, 1000, 10000],
+                        help="comma separated numbers of lines, one poem each (default: 10,100,1000,10000)")
+    parser.add_argument('--stanzas', type=int_list, default=[4], help="comma separated stanza lengths (default: 4)")
+    parser.add_argument('--scheme', default='abab', help="rhyme scheme of each stanza, x for unrhymed (default: abab)")
+    parser.add_argument('--oov-rate', type=float, default=0.0, help="fraction of words made up (default: 0)")
+    parser.add_argument('--contraction-rate', type=float, default=0.0,
+                        help="fraction of contractible words contracted (default: 0)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--source', default=config.poem_directory, help="poems to draw lines from")
+    args = parser.parse_args(argv)
+    for path in write_corpus(args.directory, args.sizes, args.stanzas, args.scheme, args.oov_rate,
+                             args.contraction_rate, args.seed, args.source):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
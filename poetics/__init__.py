@@ -1 +1 @@
-from poetics.poetics import process_poems, create_poem
+from poetics.poetics import process_poems, create_poem, iter_poems
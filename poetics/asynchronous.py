@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from poetics import config as config
+from poetics.poetics import analyze_text, get_title_and_author, get_worker_context, init_worker
+
+# Executor that analyses are run in. Created the first time it is needed (or by start).
+executor = None
+# Analyses in progress, keyed by request (see get_request_key), along with the number of callers waiting on each.
+in_flight = {}
+
+
+# Starts the executor with jobs worker processes (by default, one per core). Calling start isn't required, but lets the
+# models be loaded before the first request rather than during it.
+def start(jobs=None):
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(jobs, mp_context=get_worker_context(), initializer=init_worker)
+    return executor
+
+
+# Shuts down the executor, cancelling analyses that haven't started.
+def shutdown():
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+# Returns the key that identical requests share.
+def get_request_key(text, title, author, outputs, as_record):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest(), title, author, tuple(outputs), as_record
+
+
+# Analyzes text in a worker process without blocking the event loop, returning the poem (or, if as_record is True, a
+# dictionary of its record). Concurrent requests for the same text, title, author and outputs share a single analysis.
+# If timeout (in seconds) is reached, asyncio.TimeoutError is raised. An analysis that times out or whose callers are
+# all cancelled is cancelled too if it hasn't started yet.
+async def analyze(text, outputs=config.default_outputs, title='Unknown Poem', author='Unknown', as_record=False,
+                  timeout=None):
+    loop = asyncio.get_running_loop()
+    key = get_request_key(text, title, author, outputs, as_record)
+    if key not in in_flight:
+        future = loop.run_in_executor(start(), partial(analyze_text, text, title, author, outputs, as_record))
+        in_flight[key] = [future, 0]
+
+        # Once the analysis is done, later requests start a new one.
+        def finish(done):
+            if key in in_flight and in_flight[key][0] is done:
+                del in_flight[key]
+
+        future.add_done_callback(finish)
+    entry = in_flight[key]
+    entry[1] += 1
+    try:
+        # Shielded, so that one caller timing out or being cancelled doesn't cancel the analysis for the others.
+        return await asyncio.wait_for(asyncio.shield(entry[0]), timeout)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and not entry[0].done():
+            entry[0].cancel()
+            in_flight.pop(key, None)
+
+
+# Reads a poem file without blocking the event loop and analyzes it, as analyze does. Title and author are detected
+# from filename where they aren't provided, as by create_poem.
+async def analyze_file(filename, outputs=config.default_outputs, title=None, author=None,
+                       directory=config.poem_directory, as_record=False, timeout=None):
+    loop = asyncio.get_running_loop()
+    text = await loop.run_in_executor(None, read_file, os.path.join(directory, filename))
+    title, author = get_title_and_author(filename, title, author)
+    return await analyze(text, outputs, title, author, as_record, timeout)
+
+
+# Returns the contents of a file.
+def read_file(path):
+    with open(path, encoding="utf-8") as file:
+        return file.read()
+
+
+# Analyzes many texts concurrently, as analyze does, returning their results in the order of texts. timeout applies to
+# each text separately. A text that fails or times out has its exception in its place in the results (and is logged),
+# rather than stopping the others.
+async def analyze_many(texts, outputs=config.default_outputs, as_record=False, timeout=None):
+    results = await asyncio.gather(*[analyze(text, outputs, as_record=as_record, timeout=timeout) for text in texts],
+                                   return_exceptions=True)
+    log_failures(results, ['text %s' % index for index in range(len(texts))])
+    return results
+
+
+# Analyzes many poem files concurrently, as analyze_file does, returning their results in the order of filenames.
+async def analyze_files(filenames, outputs=config.default_outputs, directory=config.poem_directory, as_record=False,
+                        timeout=None):
+    results = await asyncio.gather(*[analyze_file(filename, outputs, directory=directory, as_record=as_record,
+                                                  timeout=timeout) for filename in filenames], return_exceptions=True)
+    log_failures(results, filenames)
+    return results
+
+
+# Logs the results that are exceptions, naming them by names.
+def log_failures(results, names):
+    for name, result in zip(names, results):
+        if isinstance(result, asyncio.TimeoutError):
+            logging.error("Analysis of %s timed out.", name)
+        elif isinstance(result, BaseException):
+            logging.error("Failed to analyze %s. %s", name, repr(result))
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import sqlite3
+
+import poetics.config as config
+from poetics.conversions import poem_to_rows
+
+
+class Exporter:
+    def __init__(self, path=config.export_path, export_format=config.export_format,
+                 batch_size=config.export_batch_size):
+        self.path = path
+        self.format = export_format
+        self.batch_size = batch_size
+        self.poems_written = 0
+        # Rows waiting to be written, by table.
+        self.rows = {table: [] for table in config.export_tables}
+        # Number of batches written so far, by table (used to name columnar batch files).
+        self.batches = {table: 0 for table in config.export_tables}
+        self.files = {}
+        self.connection = None
+
+        # Poem ids continue on from those of any poems already in the export.
+        self.next_id = 0
+
+        if export_format not in ['jsonl', 'sqlite', 'columnar']:
+            logging.warning("Unknown export format \"%s\". Exporting as jsonl.", export_format)
+            self.format = export_format = 'jsonl'
+
+        if export_format == 'sqlite':
+            self.connection = sqlite3.connect(path)
+            for table, columns in config.export_tables.items():
+                self.connection.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (table, ', '.join(columns)))
+                for columns in config.export_indexes.get(table, []):
+                    self.connection.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)'
+                                            % ('_'.join([table] + columns), table, ', '.join(columns)))
+            self.connection.commit()
+            last_id = self.connection.execute('SELECT MAX(poem_id) FROM poems').fetchone()[0]
+            self.next_id = 0 if last_id is None else last_id + 1
+        else:
+            os.makedirs(path, exist_ok=True)
+            if export_format == 'jsonl':
+                poems_path = os.path.join(path, 'poems.jsonl')
+                if os.path.isfile(poems_path):
+                    with open(poems_path, encoding="utf-8") as file:
+                        self.next_id = max([json.loads(line)['poem_id'] + 1 for line in file] or [0])
+                for table in config.export_tables:
+                    self.files[table] = open(os.path.join(path, table + '.jsonl'), 'a', encoding="utf-8")
+            else:
+                for table in config.export_tables:
+                    os.makedirs(os.path.join(path, table), exist_ok=True)
+                    # Continue numbering after any batches already in the directory.
+                    self.batches[table] = len([name for name in os.listdir(os.path.join(path, table))
+                                               if name.endswith('.json')])
+                for name in [name for name in os.listdir(os.path.join(path, 'poems')) if name.endswith('.json')]:
+                    with open(os.path.join(path, 'poems', name), encoding="utf-8") as file:
+                        self.next_id = max([self.next_id] + [poem_id + 1 for poem_id in json.load(file)['poem_id']])
+
+    def __repr__(self) -> str:
+        return '%s (%s: %s, %s poems)' % (super().__repr__(), self.format, self.path, self.poems_written)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Adds all of an analyzed poem's rows to the export. poem_id identifies the poem's rows across tables and defaults to
+    # the next unused id. The poem's rows are all made before any are added, so a poem that fails adds none.
+    def add_poem(self, poem, poem_id=None):
+        return self.add_rows(*self.get_rows(poem, poem_id))
+
+    # Returns (poem_id, [(table, row)]) for the rows that add_poem adds for a poem, without adding them.
+    def get_rows(self, poem, poem_id=None):
+        if poem_id is None:
+            poem_id = self.next_id
+        return poem_id, list(poem_to_rows(poem, poem_id))
+
+    # Adds a poem's rows (as returned by get_rows) to the export, and returns its poem_id.
+    def add_rows(self, poem_id, rows):
+        self.next_id = max(self.next_id, poem_id + 1)
+        for table, row in rows:
+            self.write_row(table, row)
+        self.poems_written += 1
+        return poem_id
+
+    # Removes all rows of the given poem ids from the export. Used to replace the results of poems that are re-analyzed.
+    def remove_poems(self, poem_ids):
+        poem_ids = set(poem_ids)
+        if not poem_ids:
+            return
+        self.flush()
+        try:
+            if self.format == 'sqlite':
+                for table in config.export_tables:
+                    self.connection.executemany('DELETE FROM %s WHERE poem_id = ?' % table,
+                                                [(poem_id,) for poem_id in poem_ids])
+                self.connection.commit()
+            elif self.format == 'jsonl':
+                for table in config.export_tables:
+                    self.files[table].close()
+                    table_path = os.path.join(self.path, table + '.jsonl')
+                    # Rewritten a line at a time, so that memory use doesn't depend on the size of the table.
+                    with open(table_path, encoding="utf-8") as file, \
+                            open(table_path + '.tmp', 'w', encoding="utf-8") as temp:
+                        temp.writelines(line for line in file if json.loads(line)['poem_id'] not in poem_ids)
+                    os.replace(table_path + '.tmp', table_path)
+                    self.files[table] = open(table_path, 'a', encoding="utf-8")
+            else:
+                for table, columns in config.export_tables.items():
+                    for name in os.listdir(os.path.join(self.path, table)):
+                        batch_path = os.path.join(self.path, table, name)
+                        with open(batch_path, encoding="utf-8") as file:
+                            batch = json.load(file)
+                        keep = [index for index, poem_id in enumerate(batch['poem_id']) if poem_id not in poem_ids]
+                        if len(keep) < len(batch['poem_id']):
+                            batch = {column: [batch[column][index] for index in keep] for column in columns}
+                            with open(batch_path, 'w', encoding="utf-8") as file:
+                                json.dump(batch, file, separators=(',', ':'))
+        except IOError as error:
+            logging.exception("Failed to remove exported data. %s for file %s [Error Number %s].", error.strerror,
+                              error.filename, error.errno, exc_info=False)
+        except sqlite3.Error as error:
+            logging.exception("Failed to remove exported data from %s. %s", self.path, error, exc_info=False)
+
+    # Adds a row to a table, writing out the table's buffered rows once there are batch_size of them. If batch_size is
+    # None, rows are only written out by flush (or close).
+    def write_row(self, table, row):
+        self.rows[table].append(row)
+        if self.batch_size and len(self.rows[table]) >= self.batch_size:
+            self.flush_table(table)
+
+    # Writes out a table's buffered rows.
+    def flush_table(self, table):
+        rows = self.rows[table]
+        if not rows:
+            return
+        columns = config.export_tables[table]
+        try:
+            if self.format == 'jsonl':
+                self.files[table].writelines(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+                self.files[table].flush()
+            elif self.format == 'sqlite':
+                self.connection.executemany('INSERT INTO %s VALUES (%s)' % (table, ', '.join(['?'] * len(columns))),
+                                            rows)
+                self.connection.commit()
+            else:
+                # Each batch is written as {column: [values]}.
+                batch = {column: [row[index] for row in rows] for index, column in enumerate(columns)}
+                batch_path = os.path.join(self.path, table, '%06d.json' % self.batches[table])
+                with open(batch_path, 'w', encoding="utf-8") as file:
+                    json.dump(batch, file, separators=(',', ':'))
+            self.batches[table] += 1
+            self.rows[table] = []
+        except IOError as error:
+            logging.exception("Failed to export data. %s for file %s [Error Number %s].", error.strerror,
+                              error.filename, error.errno, exc_info=False)
+        except sqlite3.Error as error:
+            logging.exception("Failed to export data to %s. %s", self.path, error, exc_info=False)
+
+    # Writes out the buffered rows of every table.
+    def flush(self):
+        for table in self.rows:
+            self.flush_table(table)
+
+    # Drops the buffered rows of every table without writing them.
+    def discard(self):
+        self.rows = {table: [] for table in config.export_tables}
+
+    # Writes out all buffered rows and closes the export.
+    def close(self):
+        self.flush()
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+        if self.connection:
+            self.connection.close()
+            self.connection = None
@@ -1,5 +1,8 @@
 from itertools import product
 
+from poetics.classes.metrics import Metrics
+from poetics.patterning import get_internal_rhymes
+
 
 class Line:
     def __init__(self, tokens, num, parent=None):
@@ -17,6 +20,9 @@ class Line:
 
         self.stress = []
 
+        # Internal rhymes within the line, as {feature: {rhyme key: [groups of word token indexes]}}.
+        self.internal_rhymes = {}
+
         if self.word_tokens:
             self.initial_word = self.word_tokens[0]
             self.final_word = self.word_tokens[-1]
@@ -64,6 +70,7 @@ class Line:
         # Otherwise, combinations is set to all possible combinations of the lengths of variable length syllables.
         else:
             combinations = [pros for pros in product(*[lengths for key, lengths in multi_length_tokens])]
+        Metrics.count('length_combinations', len(combinations))
         # Go through the ordered list of line lengths that was provided as length_count and see if any combinations
         # match a given length. Stop after the first length for which we find matches, as length_count is sorted.
         matches = []
@@ -97,3 +104,8 @@ class Line:
                 self.stress.append(token.stress_tendency)
             else:
                 self.stress.append([pronunciation.stress for pronunciation in token.pronunciations])
+
+    # Gets internal rhymes (perfect and rich) between word tokens within the line.
+    def get_internal_rhymes(self):
+        for feature in ['p_rhyme', 'r_rhyme']:
+            self.internal_rhymes[feature] = get_internal_rhymes([self], feature, 'line')
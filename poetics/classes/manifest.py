@@ -0,0 +1,77 @@
+import hashlib
+import json
+import logging
+import os
+
+import poetics.config as config
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        # Entries by file path (relative to the poem directory), as {'size', 'mtime', 'hash', 'version', 'title',
+        # 'author', 'poem_id', 'sinks', 'error'}, where sinks describes where the file's results were stored besides the
+        # output (see process_poems).
+        self.entries = {}
+
+        if path and os.path.isfile(path):
+            try:
+                with open(path, encoding="utf-8") as file:
+                    self.entries = json.load(file)
+            except (IOError, ValueError):
+                logging.warning("Manifest %s could not be read. All poems will be analyzed.", path)
+
+    def __repr__(self) -> str:
+        return '%s (%s files)' % (super().__repr__(), len(self.entries))
+
+    # Returns the (size, mtime, hash) of a file. The hash is only computed if entry (the file's previous manifest entry)
+    # doesn't already match the file's size and mtime.
+    def get_file_state(self, file_path, entry=None):
+        stat = os.stat(file_path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return stat.st_size, stat.st_mtime, entry['hash']
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(65536), b''):
+                digest.update(block)
+        return stat.st_size, stat.st_mtime, digest.hexdigest()
+
+    # Compares files (relative to directory) with the manifest. Returns (changed, removed), where changed lists the files
+    # that are new, have been modified, were analyzed by a different config.analysis_version, or had their results stored
+    # in different sinks, and removed lists the files in the manifest that no longer exist. Unchanged files that were
+    # touched have their mtime updated.
+    def check(self, files, directory=config.poem_directory, sinks=None):
+        changed = []
+        for file in files:
+            entry = self.entries.get(file)
+            size, mtime, file_hash = self.get_file_state(os.path.join(directory, file), entry)
+            if entry and entry['hash'] == file_hash and entry['version'] == config.analysis_version and \
+                    entry.get('sinks') == sinks:
+                entry['size'], entry['mtime'] = size, mtime
+            else:
+                changed.append(file)
+        file_set = set(files)
+        removed = [file for file in self.entries if file not in file_set]
+        return changed, removed
+
+    # Records the current state of a file after it has been analyzed, along with where its results were stored. Files
+    # that failed to be analyzed are recorded with error set to True, so that they're skipped until they're modified.
+    def update(self, file, directory=config.poem_directory, title=None, author=None, poem_id=None, sinks=None,
+               error=False):
+        size, mtime, file_hash = self.get_file_state(os.path.join(directory, file))
+        self.entries[file] = {'size': size, 'mtime': mtime, 'hash': file_hash, 'version': config.analysis_version,
+                              'title': title, 'author': author, 'poem_id': poem_id, 'sinks': sinks, 'error': error}
+
+    # Removes a file from the manifest, returning its entry.
+    def remove(self, file):
+        return self.entries.pop(file, None)
+
+    # Writes the manifest to path (or the path it was loaded from).
+    def save(self, path=None):
+        path = path or self.path
+        try:
+            with open(path, 'w', encoding="utf-8") as file:
+                json.dump(self.entries, file, sort_keys=True, indent=1)
+        except IOError as error:
+            logging.exception("Failed to write manifest. %s for file %s [Error Number %s].", error.strerror,
+                              error.filename, error.errno, exc_info=False)
@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+import poetics.config as config
+
+
+class Metrics:
+    # The metrics of the poem being analyzed by each thread, which code outside of Poem (lookups, tokens, lines) counts
+    # to through Metrics.count. Unset while no poem with metrics is being analyzed.
+    current = threading.local()
+    # lru_cached functions whose cache hits are counted, registered by the modules that define them.
+    cached_functions = []
+
+    def __init__(self, poems=1):
+        # Wall and CPU seconds spent in each stage, as {stage: [wall, cpu]}. CPU time is that of the analyzing thread.
+        # Time spent in a stage that runs another (e.g. meter running scansion) is counted to the inner stage only.
+        self.times = {}
+        self.counters = Counter()
+        # Number of poems whose metrics these are (more than one once metrics have been added together).
+        self.poems = poems
+        # Stages that are running, as [stage, wall start, cpu start, wall time of inner stages, cpu time of inner
+        # stages], along with the metrics that were current before the outermost one started and cache hits so far.
+        self.running = []
+        self.previous = None
+        self.cache_hits = 0
+
+    def __repr__(self) -> str:
+        return '%s (%s poems, %.3fs)' % (super().__repr__(), self.poems, self.get_total()[0])
+
+    # Starts timing a stage, and makes these the metrics that counts go to.
+    def start(self, stage):
+        if not self.running:
+            self.previous = getattr(Metrics.current, 'metrics', None)
+            Metrics.current.metrics = self
+            self.cache_hits = self.get_cache_hits()
+        self.running.append([stage, time.perf_counter(), time.thread_time(), 0.0, 0.0])
+
+    # Stops timing the innermost running stage.
+    def stop(self):
+        stage, wall_start, cpu_start, inner_wall, inner_cpu = self.running.pop()
+        wall = time.perf_counter() - wall_start
+        cpu = time.thread_time() - cpu_start
+        times = self.times.setdefault(stage, [0.0, 0.0])
+        times[0] += wall - inner_wall
+        times[1] += cpu - inner_cpu
+        if self.running:
+            self.running[-1][3] += wall
+            self.running[-1][4] += cpu
+        else:
+            self.counters['cache_hits'] += self.get_cache_hits() - self.cache_hits
+            Metrics.current.metrics = self.previous
+            self.previous = None
+
+    # Returns the (wall, cpu) seconds of all stages.
+    def get_total(self):
+        return sum([wall for wall, cpu in self.times.values()]), sum([cpu for wall, cpu in self.times.values()])
+
+    # Adds another poem's (or set of poems') metrics to these.
+    def add(self, other):
+        for stage, (wall, cpu) in other.times.items():
+            times = self.times.setdefault(stage, [0.0, 0.0])
+            times[0] += wall
+            times[1] += cpu
+        self.counters.update(other.counters)
+        self.poems += other.poems
+
+    # Returns the metrics as a dictionary (for json).
+    def as_dict(self):
+        return {'poems': self.poems,
+                'times': {stage: {'wall': round(wall, 6), 'cpu': round(cpu, 6)}
+                          for stage, (wall, cpu) in self.times.items()},
+                'counters': dict(self.counters)}
+
+    # Returns the total number of cache hits of the registered cached functions.
+    @staticmethod
+    def get_cache_hits():
+        return sum([function.cache_info().hits for function in Metrics.cached_functions])
+
+    # Adds amount to a counter of the current metrics, if there are any.
+    @staticmethod
+    def count(name, amount=1):
+        metrics = getattr(Metrics.current, 'metrics', None)
+        if metrics is not None:
+            metrics.counters[name] += amount
+
+    # Decorates a Poem method so that its time is recorded as stage in the poem's metrics (if it has any). If create is
+    # True, the poem's metrics are created first (if config.collect_metrics is set), for decorating Poem.__init__.
+    @staticmethod
+    def timed(stage, create=False):
+        def decorator(method):
+            @wraps(method)
+            def wrapper(self, *args, **kwargs):
+                if create:
+                    self.metrics = Metrics() if config.collect_metrics else None
+                metrics = self.metrics
+                if metrics is None:
+                    return method(self, *args, **kwargs)
+                metrics.start(stage)
+                try:
+                    return method(self, *args, **kwargs)
+                finally:
+                    metrics.stop()
+            return wrapper
+        return decorator
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import poetics.config as config
+from poetics.lookups import parse_texts
+
+
+class ParseBatcher:
+    def __init__(self, wait=config.server_batch_wait):
+        # Seconds to wait for more requests after the first one arrives, before parsing them together.
+        self.wait = wait
+        # Requests waiting to be parsed, as [texts, event, docs] (docs is filled in once parsed).
+        self.requests = []
+        self.lock = threading.Condition()
+        self.batches = 0
+        self.texts = 0
+
+        thread = threading.Thread(target=self.run, name='ParseBatcher', daemon=True)
+        thread.start()
+
+    def __repr__(self) -> str:
+        return '%s (%s texts in %s batches)' % (super().__repr__(), self.texts, self.batches)
+
+    # Returns spaCy docs for texts, as parse_texts does, but parses them together with the texts of any other requests
+    # made at about the same time (from other threads), in a single pass of the model.
+    def parse(self, texts):
+        request = [list(texts), threading.Event(), None]
+        with self.lock:
+            self.requests.append(request)
+            self.lock.notify()
+        request[1].wait()
+        if isinstance(request[2], Exception):
+            raise request[2]
+        return request[2]
+
+    # Parses requests in batches, for as long as the process runs.
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.requests:
+                    self.lock.wait()
+            # Give other requests a moment to arrive.
+            time.sleep(self.wait)
+            with self.lock:
+                requests, self.requests = self.requests, []
+            texts = [text for request in requests for text in request[0]]
+            try:
+                docs = parse_texts(texts)
+            except Exception as error:
+                docs = None
+                for request in requests:
+                    request[2] = error
+            if docs is not None:
+                start = 0
+                for request in requests:
+                    request[2] = docs[start:start + len(request[0])]
+                    start += len(request[0])
+            self.batches += 1
+            self.texts += len(texts)
+            for request in requests:
+                request[1].set()
@@ -1,21 +1,26 @@
-import csv
 import logging
 import re
 
 from poetics import config as config
 from poetics.classes.line import Line
+from poetics.classes.metrics import Metrics
+from poetics.classes.record_writer import RecordWriter
 from poetics.classes.sentence import Sentence
 from poetics.classes.stanza import Stanza
 from poetics.classes.token import Token
 from poetics.classes.word import Word
-from poetics.conversions import tokenize, full_tokenize, feats_to_scheme, title_case
-from poetics.logging import tags_with_text, convert_scansion, header1, header1d, header2, join_list_proper
-from poetics.lookups import name_meter, name_poem
-from poetics.patterning import check_meters, predict_scan, pattern_match_ratio, check_for_words, \
-    maximize_token_matches, get_acrostics
+from poetics.conversions import tokenize, full_tokenize, feats_to_scheme, title_case, iter_sonic_groups
+from poetics.logging import tags_with_text, convert_scansion, header1, header1d, header2, join_list_proper, \
+    print_sound_set
+from poetics.lookups import name_meter, name_poem, get_word_trie, parse_texts
+from poetics.patterning import check_meters, predict_scan, decode_scansion, check_for_words, \
+    maximize_rhyme_matches, get_rhyme_rows, get_sight_sequences, get_hidden_words
 
 
 class Poem:
+    # self.metrics (set by Metrics.timed) holds the time spent in each stage of analysis and counts of costly events if
+    # config.collect_metrics is set, and is None otherwise.
+    @Metrics.timed('construction', create=True)
     def __init__(self, text, title='Unknown Poem', author='Unknown'):
         self.title = title_case(title)
         self.author = title_case(author)
@@ -33,6 +38,14 @@ class Poem:
         self.sentences = []
         self.stanzas = []
 
+        # Poem-wide sonic features, as {feature: {sound: [groups of word token indexes]}}.
+        self.sonic_features = {}
+
+        # Readings of acrostic-like letter sequences, as {sequence name: [readings]}, and words hidden in the initial and
+        # final letters of lines, as {sequence name: [(index of first line, word)]}.
+        self.acrostics = {}
+        self.hidden_words = {}
+
         self.lines_by_syllable = {}
         self.scans = {}
         self.meters = {}
@@ -110,7 +123,8 @@ class Poem:
         for line in self.lines:
             if not line.is_blank:
                 words_per_line.append(len(line.word_tokens))
-        self.avg_words_per_line = sum(words_per_line) // len(words_per_line)
+        # Poems without any words (e.g. empty files) average 0.
+        self.avg_words_per_line = sum(words_per_line) // len(words_per_line) if words_per_line else 0
 
         # Find words that failed to find pronunciations during their init, add them to unrecognized_words.
         for word in self.words:
@@ -120,20 +134,25 @@ class Poem:
         if len(self.unrecognized_words) > 0:
             logging.error("Unrecognized words: %s", ", ".join(self.unrecognized_words))
 
+    @Metrics.timed('rhyme')
     def get_rhymes(self):
         # List of features that correspond to rhyme types.
-        features = ['p_rhyme', 'r_rhyme', 'str_vowel', 'str_fin_con', 'str_bkt_cons', 'str_ini_con', 'word_ini_con']
+        features = config.rhyme_features
 
         # Have final/initial words in each line cull pronunciations based on maximizing rhyme/assonance/etc.
         final_words = [line.final_word for line in self.lines if not line.is_blank]
         init_words = [line.initial_word for line in self.lines if not line.is_blank]
-        for feature in features:
-            maximize_token_matches(final_words, feature)
-            maximize_token_matches(init_words, feature)
+        maximize_rhyme_matches([final_words, init_words], features)
+
+        # Extract the values of every feature (and near rhyme clusters) for line-final and line-initial words once, for
+        # use in both poem and stanza schemes. Blank lines and words without pronunciations have None in place of
+        # feature values.
+        f_rows = dict(zip(self.lines, get_rhyme_rows([line.final_word for line in self.lines], features)))
+        i_rows = dict(zip(self.lines, get_rhyme_rows([line.initial_word for line in self.lines], features)))
 
         # Have stanzas get rhyme schemes.
         for stanza in self.stanzas:
-            stanza.get_rhymes()
+            stanza.get_rhymes(f_rows, i_rows)
 
         # Creates a threshold that is used to determine if a given rhyme type should have a scheme generated. If the
         # number of unique entries (letters) in the given scheme would be higher than the threshold, then no scheme
@@ -142,15 +161,11 @@ class Poem:
         # generated.
         threshold = (self.num_lines // 2) + (self.num_lines % 2 > 0)
 
-        # Generate schemes for each feature.
-        for feature in features:
-            f_scheme = feats_to_scheme([' ' if line.is_blank or not line.final_word.pronunciations
-                                        else getattr(line.final_word.pronunciations[0], feature)
-                                        for line in self.lines],
+        # Generate schemes for each feature (rows have a column for each of features, then one for near rhyme).
+        for column, feature in enumerate(features + ['n_rhyme']):
+            f_scheme = feats_to_scheme([f_rows[line][column] if f_rows[line] else ' ' for line in self.lines],
                                        False, False, threshold)
-            i_scheme = feats_to_scheme([' ' if line.is_blank or not line.initial_word.pronunciations
-                                        else getattr(line.initial_word.pronunciations[0], feature)
-                                        for line in self.lines],
+            i_scheme = feats_to_scheme([i_rows[line][column] if i_rows[line] else ' ' for line in self.lines],
                                        False, False, threshold)
             # If a scheme was returned (feats_to_scheme will return None if the number of unique entries exceeded
             # threshold), then add it to the poem's list of line-final (f_) or line-initial (i_) schemes.
@@ -176,43 +191,93 @@ class Poem:
             if len(stanza_schemes) > 1:
                 logging.info("Stanza %s Schemes: %s", config.rhyme_scheme_names[feature][1], ', '.join(stanza_schemes))
 
+        # Have stanzas (and their lines) get internal rhymes, and log them.
+        for index, stanza in enumerate(self.stanzas):
+            stanza.get_internal_rhymes()
+            if stanza.internal_rhymes['p_rhyme'] or stanza.internal_rhymes['r_rhyme']:
+                header2('Stanza %s (%s...)' % (index + 1, ' '.join([token.token for token in stanza.word_tokens[0:4]])))
+                stanza.print_internal_rhymes()
+
         # Set a boolean for rhyme having been calculated.
         self.got_rhyme = True
 
+    @Metrics.timed('sonic')
     def get_sonic_features(self):
-        # Has stanzas get their sonic features.
-        for stanza in self.stanzas:
-            stanza.get_sonic_features()
-        # Have stanzas report their sonic features.
+        # Stream sonic features across the whole poem once. Groups within a stanza go to that stanza (with indexes
+        # relative to its word tokens), and groups that cross stanza boundaries are kept aside to be reported on their own.
+        positions = {token: (index, position) for index, stanza in enumerate(self.stanzas)
+                     for position, token in enumerate(stanza.word_tokens)}
+        stanza_groups = [[] for stanza in self.stanzas]
+        self.sonic_features = {feature: {} for feature in config.sonic_features}
+        crossing = {feature: {} for feature in config.sonic_features}
+        for feature, sound, indexes in self.iter_sonic_features('poem'):
+            self.sonic_features[feature].setdefault(sound, []).append(indexes)
+            stanzas = set([positions[self.word_tokens[index]][0] for index in indexes])
+            if len(stanzas) == 1:
+                stanza_groups[stanzas.pop()].append((feature, sound, [positions[self.word_tokens[index]][1]
+                                                                      for index in indexes]))
+            else:
+                crossing[feature].setdefault(sound, []).append(indexes)
+        for stanza, groups in zip(self.stanzas, stanza_groups):
+            stanza.get_sonic_features(groups)
+
+        # Have stanzas report their sonic features, then report the groups that cross stanza boundaries.
         header1("Sonic Features")
         for index, stanza in enumerate(self.stanzas):
             header2('Stanza %s (%s...)' % (index + 1, ' '.join([token.token for token in stanza.word_tokens[0:4]])))
             stanza.print_sonic_features()
+        if any(crossing.values()):
+            header2('Across Stanzas')
+            tokens = [token.token for token in self.word_tokens]
+            for feature, sounds in crossing.items():
+                if sounds:
+                    print_sound_set(config.sonic_features[feature], sounds, tokens)
+
+    # Streams sonic feature groups over the poem's word tokens as (feature, sound, [word token indexes]). With scope
+    # 'poem', groups can cross stanza boundaries; with scope 'stanza', they are closed at the start of each stanza.
+    def iter_sonic_features(self, scope='poem'):
+        breaks = None
+        if scope == 'stanza':
+            starts = set([stanza.word_tokens[0] for stanza in self.stanzas if stanza.word_tokens])
+            breaks = set([index for index, token in enumerate(self.word_tokens) if token in starts])
+        max_distance = max(self.avg_words_per_line, 5)
+        yield from iter_sonic_groups(self.word_tokens, config.sonic_features, max_distance, 3, breaks)
 
     def get_rhetorical_features(self):
         return
 
     # Gets sight features of the poem.
+    @Metrics.timed('sight')
     def get_sight_features(self):
-        i_chars = ''.join([line.initial_word.token[0] for line in self.lines if not line.is_blank]).lower()
-        f_chars = ''.join([line.final_word.token[-1] for line in self.lines if not line.is_blank]).lower()
-        i_acros = get_acrostics(i_chars)
-        f_acros = get_acrostics(f_chars)
+        lines = [line for line in self.lines if not line.is_blank and any([char.isalpha() for char in str(line)])]
+        sequences = get_sight_sequences([str(line) for line in lines])
+        # All sequences are read against the same trie in one batch.
+        trie = get_word_trie()
+        self.acrostics = trie.get_batch_segmentations(sequences)
+        # Words hidden in the initial and final letters of runs of lines.
+        self.hidden_words = {name: get_hidden_words(sequences[name], trie) for name in ['Acrostic', 'Telestich']
+                             if name in sequences}
         header1("Sight Features")
-        if i_acros:
-            header2("Initial Acrostics")
-            for reading in i_acros:
-                logging.info(' '.join(reading))
-        if f_acros:
-            header2("Final Acrosstics")
-            for reading in f_acros:
-                logging.info(' '.join(reading))
-
-    # Gets parts of speech for word tokens.
-    def get_pos(self):
-        # Have each sentence get parts of speech
-        for sentence in self.sentences:
-            sentence.get_pos()
+        for name, readings in self.acrostics.items():
+            if readings:
+                # Pluralize the reading's name ahead of any parenthetical, e.g. "Mesostichs (Letter 2)".
+                header2(re.sub(r'^([^(]+?)(?= \(|$)', r'\1s', name))
+                for reading in readings:
+                    logging.info(' '.join(reading))
+        for name, words in self.hidden_words.items():
+            if words:
+                header2('Hidden Words (%s)' % name)
+                for start, word in words:
+                    logging.info('%s (lines %s-%s)', word, lines[start].num, lines[start + len(word) - 1].num)
+
+    # Gets parts of speech for word tokens. parser optionally replaces parse_texts for turning sentence texts into spaCy
+    # docs (e.g. to batch the sentences of many poems together).
+    @Metrics.timed('pos')
+    def get_pos(self, parser=parse_texts):
+        # Parse all sentences at once, then have each sentence get parts of speech from its doc.
+        docs = parser([sentence.get_text() for sentence in self.sentences])
+        for sentence, doc in zip(self.sentences, docs):
+            sentence.get_pos(doc)
         # Log parts of speech by line.
         header1('Parts of speech')
         for line in self.lines:
@@ -224,6 +289,7 @@ class Poem:
         # Set a boolean for pos having been calculated.
         self.got_pos = True
 
+    @Metrics.timed('scansion')
     def get_scansion(self):
         # Get parts of speech if we haven't already.
         if not self.got_pos:
@@ -271,44 +337,22 @@ class Poem:
             predicted_merged, best_match = check_meters(key, predicted, predicted_single)
             self.scans[key] = (predicted, predicted_single, predicted_merged, best_match)
 
-        # Choose stress for single syllable words and words that have multiple stress patterns.
+        # Choose stress for single syllable words and words that have multiple stress patterns. Each line is decoded as
+        # a whole against best_match (or predicted_merged if no best_match is available), so that the choice for one
+        # word can't misalign the rest of the line.
         for line in self.lines:
             if not line.is_blank:
-                position = 0
                 best = self.scans[line.syllables][3]
-                pattern = self.scans[line.syllables][3]
-                # If we have no best_match, we use predicted_merged.
-                if not pattern:
-                    pattern = self.scans[line.syllables][2]
-                # Loop through word tokens in lines.
-                for token in line.word_tokens:
-                    # Resolves words with multiple possible stress patterns based on best_match or predicted_merged
-                    # if no best_match is available.
+                pattern = best or self.scans[line.syllables][2]
+                # Single syllable words only resolve against the pattern if we have a best_match, otherwise they
+                # resolve using their stress tendency.
+                token_candidates = [token.get_stress_candidates(bool(best)) for token in line.word_tokens]
+                chosen = decode_scansion(token_candidates, pattern)
+                for token, candidates, index in zip(line.word_tokens, token_candidates, chosen):
                     if len(token.pronunciations[0].stress) > 1:
-                        ratios = []
-                        stresses = [pronunciation.stress for pronunciation in token.pronunciations]
-                        for stress in stresses:
-                            ratios.append(pattern_match_ratio(stress, pattern[position:position + len(stress)]))
-                        best_index = ratios.index(max(ratios))
-                        token.cull_pronunciations('stress', stresses[best_index])
-                        position += len(stresses[best_index])
-                    # Resolves single syllable words using best_match or stress tendency if we have no best_match.
-                    else:
-                        if token.stress_tendency == ['S'] or token.stress_tendency == ['W']:
-                            if not best:
-                                token.stress_override = '1'
-                                position += 1
-                            else:
-                                token.stress_override = best[position]
-                                position += 1
-                        # Note: words with neutral tendency resolve as unstressed if we have no best_match.
-                        elif token.stress_tendency == ['U'] or token.stress_tendency == ['N']:
-                            if not best:
-                                token.stress_override = '0'
-                                position += 1
-                            else:
-                                token.stress_override = best[position]
-                                position += 1
+                        token.cull_pronunciations('stress', candidates[index])
+                    elif token.stress_tendency:
+                        token.stress_override = candidates[index]
 
         # Log scansion.
         header1('Scansion')
@@ -332,6 +376,7 @@ class Poem:
         # Set a boolean for scansion having been calculated.
         self.got_scansion = True
 
+    @Metrics.timed('meter')
     def get_meter(self):
         if not self.got_scansion:
             logging.warning("Scansion required for meter. Generating scansion...")
@@ -405,6 +450,7 @@ class Poem:
         if lines_missing_meter:
             logging.warning("No meter available for lines marked with *.")
 
+    @Metrics.timed('form')
     def get_form(self):
         # If we haven't generated scansion yet, warn the user and do so.
         if not self.got_scansion:
@@ -460,9 +506,11 @@ class Poem:
         logging.info("Poetic Form: %s", poem_out)
         logging.info("Stanzaic Form%s: %s", stanza_plural, '; '.join(stanza_out))
 
-    # Records poem attributes to csv.
+    # Records poem attributes to csv. If writer (a RecordWriter) is provided, the record is passed to it to be written with
+    # its next batch, rather than written to outputfile straight away. source (e.g. the file the poem was read from) is
+    # recorded along with the poem if given (see RecordWriter.write).
     # TODO: should record the rest of the poem's attributes.
-    def record(self, outputfile=config.output_file):
+    def record(self, outputfile=config.output_file, writer=None, source=None):
         if not self.got_rhyme:
             logging.warning("Rhyme required for recording. Generating rhyme...")
             self.get_pos()
@@ -476,31 +524,20 @@ class Poem:
             logging.warning("Meter required for recording. Generating meter...")
             self.get_pos()
 
-        field_headers = ['Title', 'Author', '# Lines', '# Words', 'Perfect Rhyme Scheme']
-        try:
-            # Check to see if output already has any data in it
-            with open(outputfile, 'r', newline='\n', encoding="utf-8") as file:
-                contents = csv.reader(file)
-                rows = sum(1 for _ in contents)
-            # If output doesn't have any data, add a header row
-            if rows == 0:
-                with open(outputfile, 'a', newline='\n', encoding="utf-8") as file:
-                    writer = csv.writer(file)
-                    writer.writerow(field_headers)
-
-            output = list()
-            output.append(self.title)  # Title
-            output.append(self.author)  # Author
-            output.append(len(self.lines))  # Line count
-            output.append(len(self.word_tokens))  # Word count
-            output.append(self.f_rhyme_schemes.get('p_rhyme'))
-
-            with open(outputfile, 'a', newline='\n', encoding="utf-8") as file:
-                writer = csv.writer(file)
-                writer.writerow(output)
-
-            logging.info("Data for \"%s\" succesfully appended to %s", self.title, outputfile)
-
-        except IOError as error:
-            logging.exception("Failed to record data. %s for file %s [Error Number %s].", error.strerror,
-                              error.filename, error.errno, exc_info=False)
+        if writer:
+            writer.write(self, source)
+        else:
+            with RecordWriter(outputfile) as writer:
+                writer.write(self, source)
+
+    # Returns the row that record writes for the poem, with columns matching config.record_headers.
+    def get_record(self):
+        output = list()
+        output.append(self.title)  # Title
+        output.append(self.author)  # Author
+        output.append(len(self.lines))  # Line count
+        output.append(len(self.word_tokens))  # Word count
+        output.append(self.f_rhyme_schemes.get('p_rhyme'))
+        output.append(sum([len(groups) for stanza in self.stanzas
+                           for groups in stanza.internal_rhymes.get('p_rhyme', {}).values()]))  # Internal rhymes
+        return output
@@ -0,0 +1,132 @@
+import cProfile
+import json
+import logging
+import marshal
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+import poetics.config as config
+
+
+class Profiler:
+    def __init__(self, interval=config.profile_interval):
+        # Seconds of CPU time between stack samples.
+        self.interval = interval
+        # cProfile stats of everything profiled, merged, as pstats keeps them ({function: (primitive calls, calls, total
+        # time, cumulative time, callers)}).
+        self.stats = {}
+        # Number of samples of each stack, as {'poem;outer function;...;inner function': samples}.
+        self.stacks = Counter()
+        # Profiled seconds of each poem.
+        self.poems = {}
+        # State of the current run: its cProfile profile, stack samples (as {(inner code, ..., outer code): samples}),
+        # and the frame that sampled stacks stop at. Also labels of sampled functions, by code object.
+        self.profile = None
+        self.samples = Counter()
+        self.entry = None
+        self.labels = {}
+
+    def __repr__(self) -> str:
+        return '%s (%s poems, %s samples)' % (super().__repr__(), len(self.poems), sum(self.stacks.values()))
+
+    # Runs function with args under cProfile, sampling its stacks at the same time where the platform allows it (SIGPROF
+    # in the main thread). Returns (function's result, profile), where profile is a dictionary of the run's stats, stacks
+    # and seconds that can be passed between processes and added to another profiler with add. cProfile stays enabled
+    # while stacks are sampled (disabling it would end the timing of every open call), and the sampler's own calls are
+    # removed from the stats afterwards.
+    def run(self, function, *args, **kwargs):
+        sampling = hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+        self.samples = Counter()
+        self.entry = sys._getframe()
+        self.profile = cProfile.Profile()
+        if sampling:
+            handler = signal.signal(signal.SIGPROF, self.sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        start = time.perf_counter()
+        self.profile.enable()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            self.profile.disable()
+            seconds = time.perf_counter() - start
+            if sampling:
+                signal.setitimer(signal.ITIMER_PROF, 0)
+                signal.signal(signal.SIGPROF, handler)
+        self.profile.create_stats()
+        stats = self.profile.stats
+        if sampling:
+            self.remove_function(stats, self.sample.__code__)
+        stacks = Counter()
+        for stack, samples in self.samples.items():
+            stacks[';'.join([self.get_label(code) for code in reversed(stack)])] += samples
+        profile = {'stats': stats, 'stacks': dict(stacks), 'seconds': seconds}
+        self.profile, self.samples, self.entry = None, Counter(), None
+        return result, profile
+
+    # Records the stack below the frame that run was called from (SIGPROF handler). As it runs under cProfile, it only
+    # calls builtins, so that remove_function can take out everything it adds to the stats.
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None and frame is not self.entry:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack = tuple(stack)
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    # Returns the label of a sampled function's code object: 'name (file:line)'.
+    def get_label(self, code):
+        if code not in self.labels:
+            self.labels[code] = '%s (%s:%s)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+        return self.labels[code]
+
+    # Removes the function with code object code from stats (as made by cProfile), along with the calls it made, which
+    # are subtracted from the stats of the functions called. Its time stays in the cumulative time of its callers.
+    @staticmethod
+    def remove_function(stats, code):
+        function = (code.co_filename, code.co_firstlineno, code.co_name)
+        stats.pop(function, None)
+        for callee, (primitive, calls, total, cumulative, callers) in list(stats.items()):
+            if function not in callers:
+                continue
+            caller_primitive, caller_calls, caller_total, caller_cumulative = callers.pop(function)
+            if calls <= caller_calls:
+                del stats[callee]
+            else:
+                stats[callee] = (primitive - caller_primitive, calls - caller_calls, total - caller_total,
+                                 cumulative - caller_cumulative, callers)
+
+    # Adds a profile returned by run to the profiler, tagging its stacks with poem.
+    def add(self, poem, profile):
+        for function, stats in profile['stats'].items():
+            if function in self.stats:
+                self.stats[function] = pstats.add_func_stats(self.stats[function], stats)
+            else:
+                self.stats[function] = stats
+        tag = poem.replace(';', ',')
+        for stack, samples in profile['stacks'].items():
+            self.stacks[tag + ';' + stack if stack else tag] += samples
+        self.poems[poem] = self.poems.get(poem, 0) + profile['seconds']
+
+    # Writes the merged stats to path (readable by pstats, snakeviz, etc.), the sampled stacks in collapsed format (one
+    # 'frame;frame;frame samples' line per stack, for flamegraph.pl, speedscope, etc.) to path + '.collapsed', and the
+    # profiled seconds of each poem, slowest first, to path + '.poems.json'.
+    def dump(self, path):
+        try:
+            with open(path, 'wb') as file:
+                marshal.dump(self.stats, file)
+            with open(path + '.collapsed', 'w', encoding="utf-8") as file:
+                file.writelines('%s %s\n' % (stack, samples) for stack, samples in sorted(self.stacks.items()))
+            with open(path + '.poems.json', 'w', encoding="utf-8") as file:
+                json.dump(dict(self.get_slowest()), file, indent=1)
+        except IOError as error:
+            logging.exception("Failed to write profile. %s for file %s [Error Number %s].", error.strerror,
+                              error.filename, error.errno, exc_info=False)
+
+    # Returns a list of (poem, seconds), slowest first, of the count slowest poems (or all poems).
+    def get_slowest(self, count=None):
+        return sorted(self.poems.items(), key=lambda item: item[1], reverse=True)[:count]
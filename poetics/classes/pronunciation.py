@@ -69,6 +69,14 @@ class Pronunciation:
         self.r_rhyme = ' '.join([segment for segment in rich_rhyme if segment])
         self.p_rhyme = ' '.join([segment for segment in perfect_rhyme if segment])
 
+    # Returns the pronunciation's keys for a rhyme type (a feature from config.rhyme_index_types). Near rhyme can have
+    # multiple keys (one per word ending), the other types have at most one.
+    def get_rhyme_keys(self, rhyme_type):
+        if rhyme_type == 'n_rhyme':
+            return list(self.n_rhyme or ())
+        value = getattr(self, rhyme_type)
+        return [value] if value else []
+
     def __str__(self) -> str:
         return self.plaintext
 
@@ -0,0 +1,123 @@
+import csv
+import logging
+import os
+
+import poetics.config as config
+
+
+class RecordWriter:
+    def __init__(self, path=config.output_file, batch_size=config.record_batch_size, headers=config.record_headers):
+        self.path = path
+        self.batch_size = batch_size
+        self.headers = headers
+        # Rows waiting to be written.
+        self.rows = []
+        self.rows_written = 0
+        self.file = None
+        self.writer = None
+
+        try:
+            # A header is only needed if the output doesn't have any data in it yet.
+            write_header = not os.path.isfile(path) or os.path.getsize(path) == 0
+            if not write_header:
+                with open(path, newline='\n', encoding="utf-8") as file:
+                    header = next(csv.reader(file), [])
+                # Outputs written before columns were added to the end of the headers get the new headers. Their
+                # existing rows are left as they are.
+                if header != headers and headers[:len(header)] == header:
+                    self.rewrite(header=headers)
+                elif header != headers:
+                    logging.warning("Output %s has different columns than %s.", path, ', '.join(headers))
+            self.file = open(path, 'a', newline='\n', encoding="utf-8")
+            self.writer = csv.writer(self.file)
+            if write_header:
+                self.writer.writerow(headers)
+        except IOError as error:
+            logging.exception("Failed to open output. %s for file %s [Error Number %s].", error.strerror,
+                              error.filename, error.errno, exc_info=False)
+
+    def __repr__(self) -> str:
+        return '%s (%s: %s rows written, %s buffered)' % (super().__repr__(), self.path, self.rows_written,
+                                                          len(self.rows))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Adds a poem's record to the buffer, writing the buffer out once it holds batch_size rows. source, if given, is
+    # recorded after the record (in the File column of config.batch_record_headers).
+    def write(self, poem, source=None):
+        self.write_row(poem.get_record() + ([source] if source is not None else []))
+        logging.info("Data for \"%s\" queued for %s", poem.title, self.path)
+
+    # Adds a row (e.g. one produced by Poem.get_record in another process) to the buffer. If batch_size is None, rows are
+    # only written out by flush (or close).
+    def write_row(self, row):
+        self.rows.append(row)
+        if self.batch_size and len(self.rows) >= self.batch_size:
+            self.flush()
+
+    # Writes out all buffered rows.
+    def flush(self):
+        if not self.rows or not self.writer:
+            return
+        try:
+            self.writer.writerows(self.rows)
+            self.file.flush()
+            self.rows_written += len(self.rows)
+            self.rows = []
+        except IOError as error:
+            logging.exception("Failed to record data. %s for file %s [Error Number %s].", error.strerror,
+                              error.filename, error.errno, exc_info=False)
+
+    # Drops all buffered rows without writing them.
+    def discard(self):
+        self.rows = []
+
+    # Removes the records of poems from the output, where sources is a set of the files that the poems were read from (as
+    # recorded in the File column). Records without a File column (written before it was added) are matched on (title,
+    # author) against keys instead. Used to replace the records of poems that are re-analyzed.
+    def remove_records(self, sources, keys=frozenset()):
+        if not (sources or keys) or not self.file:
+            return
+        self.flush()
+        self.file.close()
+        column = self.headers.index('File') if 'File' in self.headers else None
+
+        # Returns True for rows that aren't the records of the removed poems.
+        def keep(row):
+            if column is not None and len(row) > column and row[column]:
+                return row[column] not in sources
+            return tuple(row[:2]) not in keys
+
+        self.rewrite(keep)
+        self.file = open(self.path, 'a', newline='\n', encoding="utf-8")
+        self.writer = csv.writer(self.file)
+
+    # Rewrites the output (which mustn't be open) with only the rows for which keep(row) is True, and with header in place
+    # of its header row if header is given.
+    def rewrite(self, keep=None, header=None):
+        temp_path = self.path + '.tmp'
+        try:
+            with open(self.path, newline='\n', encoding="utf-8") as file, \
+                    open(temp_path, 'w', newline='\n', encoding="utf-8") as temp:
+                writer = csv.writer(temp)
+                for index, row in enumerate(csv.reader(file)):
+                    if index == 0:
+                        writer.writerow(header or row)
+                    elif not keep or keep(row):
+                        writer.writerow(row)
+            os.replace(temp_path, self.path)
+        except IOError as error:
+            logging.exception("Failed to rewrite output. %s for file %s [Error Number %s].", error.strerror,
+                              error.filename, error.errno, exc_info=False)
+
+    # Writes out all buffered rows and closes the output.
+    def close(self):
+        self.flush()
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.writer = None
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+
+import poetics.config as config
+from poetics.lookups import get_rhyme_keys
+
+
+class RhymeIndex:
+    def __init__(self, path=config.corpus_rhyme_index_file):
+        self.path = path
+        # For each rhyme type, a dictionary of {rhyme key: [[title, author, line number, source], ...]}, where source (if
+        # given to add_poem) identifies the file the poem was read from.
+        self.occurrences = {rhyme_type: {} for rhyme_type in config.rhyme_index_types}
+
+        # Load an existing index if there is one.
+        if path and os.path.isfile(path):
+            with open(path, encoding="utf-8") as file:
+                self.occurrences.update(json.load(file))
+
+    def __repr__(self) -> str:
+        return '%s (%s keys)' % (super().__repr__(), len(self.occurrences['p_rhyme']))
+
+    # Adds the line-final words of a poem to the index. source (e.g. the file the poem was read from) is stored with each
+    # occurrence, so that the poem can later be removed by it.
+    def add_poem(self, poem, source=None):
+        self.add_entries(self.get_entries(poem, source))
+
+    # Returns the entries that add_poem adds for a poem, as [(rhyme type, rhyme key, entry)], without adding them.
+    @staticmethod
+    def get_entries(poem, source=None):
+        entries = []
+        for line in poem.lines:
+            if line.is_blank or not line.final_word.pronunciations:
+                continue
+            for rhyme_type in config.rhyme_index_types:
+                for key in line.final_word.pronunciations[0].get_rhyme_keys(rhyme_type):
+                    entries.append((rhyme_type, key, [poem.title, poem.author, line.num, source]))
+        return entries
+
+    # Adds entries (as returned by get_entries) to the index.
+    def add_entries(self, entries):
+        for rhyme_type, key, entry in entries:
+            self.occurrences[rhyme_type].setdefault(key, []).append(entry)
+
+    # Removes all entries for a poem from the index. If source is given, entries stored with a source are removed if it
+    # matches, and only entries stored without one are matched on title and author.
+    def remove_poem(self, title, author, source=None):
+        # Returns True for entries of the removed poem.
+        def matches(entry):
+            if source is not None and len(entry) > 3 and entry[3] is not None:
+                return entry[3] == source
+            return entry[0] == title and entry[1] == author
+
+        for keys in self.occurrences.values():
+            for key in list(keys):
+                keys[key] = [entry for entry in keys[key] if not matches(entry)]
+                if not keys[key]:
+                    del keys[key]
+
+    # Returns the (title, author, line number) occurrences of a rhyme key for a rhyme type.
+    def get_occurrences(self, key, rhyme_type='p_rhyme'):
+        return [tuple(entry[:3]) for entry in self.occurrences[rhyme_type].get(key, [])]
+
+    # Returns the occurrences of every key that a word has for a rhyme type, as found in the lexicon-wide rhyme index.
+    def get_word_occurrences(self, word, rhyme_type='p_rhyme'):
+        return [occurrence for key in get_rhyme_keys(word, rhyme_type)
+                for occurrence in self.get_occurrences(key, rhyme_type)]
+
+    # Writes the index to path (or the path it was loaded from).
+    def save(self, path=None):
+        path = path or self.path
+        try:
+            with open(path, 'w', encoding="utf-8") as file:
+                json.dump(self.occurrences, file, sort_keys=True, separators=(',', ':'))
+            logging.info("Rhyme index written to %s", path)
+        except IOError as error:
+            logging.exception("Failed to write rhyme index. %s for file %s [Error Number %s].", error.strerror,
+                              error.filename, error.errno, exc_info=False)
@@ -16,14 +16,20 @@ class Sentence:
     def __repr__(self) -> str:
         return '%s (%s)' % (super().__repr__(), ' '.join([token.token for token in self.word_tokens[0:2]]))
 
-    def get_pos(self):
+    # Returns the text of the sentence as it is given to spaCy.
+    def get_text(self):
         # TODO: Needs testing for abbreviations.
         text = ''.join([token.token for token in self.tokens])
         # Removes newlines and decapitalizes the first words of successive lines (spaCy tends to regard capitalized
         # words that aren't sentence initial as proper nouns).
-        text = re.sub("\n\s*(\W)*(\S)", lambda m: " " + (m.group(1) or "") + m.group(2).lower(), text)
+        return re.sub("\n\s*(\W)*(\S)", lambda m: " " + (m.group(1) or "") + m.group(2).lower(), text)
+
+    # Sets parts of speech, dependencies and lemmas for the sentence's word tokens. sentence optionally provides the spaCy
+    # doc for the sentence's text (see get_text), if it has already been parsed.
+    def get_pos(self, sentence=None):
         # Create spaCy doc.
-        sentence = config.spacy_model(text)
+        if sentence is None:
+            sentence = config.spacy_model(self.get_text())
 
         # Creates a list of the indexes of tokens that conjunctions should be merged into. conjunction_index stores
         # these as a list of lists each of which contains [<conjunction index>, <merge target index>].
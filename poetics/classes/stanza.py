@@ -1,6 +1,8 @@
-from poetics.conversions import get_sound_set_groups, feats_to_scheme
+import poetics.config as config
+from poetics.conversions import feats_to_scheme, iter_sonic_groups
 from poetics.logging import print_sound_set
 from poetics.lookups import name_stanza
+from poetics.patterning import get_rhyme_rows, get_internal_rhymes
 
 
 class Stanza:
@@ -20,11 +22,11 @@ class Stanza:
         # Stanza internal sonic features.
         self.p_rhyme = None
         self.r_rhyme = None
-        self.asso = None
-        self.cons = None
-        self.bkt_cons = None
-        self.str_allit = None
-        self.ini_allit = None
+        # Sonic features, as {feature: {sound: [groups of word token indexes]}}.
+        self.sonic_features = {}
+
+        # Internal rhymes, as {feature: {rhyme key: [groups of word token indexes]}}.
+        self.internal_rhymes = {}
 
     def __str__(self) -> str:
         return ''.join([token.token for token in self.tokens])
@@ -32,18 +34,39 @@ class Stanza:
     def __repr__(self) -> str:
         return '%s (%s)' % (super().__repr__(), ' '.join([token.token for token in self.word_tokens[0:2]]))
 
-    def get_rhymes(self):
+    # Gets line-initial and line-final rhyme schemes. f_rows and i_rows optionally provide the feature values of
+    # line-final and line-initial words keyed by line (as extracted by the parent poem).
+    def get_rhymes(self, f_rows=None, i_rows=None):
         # List of features that correspond to rhyme types.
-        features = ['p_rhyme', 'r_rhyme', 'str_vowel', 'str_fin_con', 'str_bkt_cons', 'str_ini_con', 'word_ini_con']
+        features = config.rhyme_features
+        if f_rows is None:
+            f_rows = dict(zip(self.lines, get_rhyme_rows([line.final_word for line in self.lines], features)))
+        if i_rows is None:
+            i_rows = dict(zip(self.lines, get_rhyme_rows([line.initial_word for line in self.lines], features)))
+
+        # Get line initial and line final schemes for each feature (rows have a column for each of features, then one
+        # for near rhyme).
+        for column, feature in enumerate(features + ['n_rhyme']):
+            self.f_rhyme_schemes[feature] = feats_to_scheme([f_rows[line][column] for line in self.lines
+                                                             if f_rows[line]], True, True)
+            self.i_rhyme_schemes[feature] = feats_to_scheme([i_rows[line][column] for line in self.lines
+                                                             if i_rows[line]], True, True)
+
+    # Gets internal rhymes (perfect and rich) for the stanza and each of its lines. Window optionally overrides
+    # config.internal_rhyme_window.
+    def get_internal_rhymes(self, window=config.internal_rhyme_window):
+        for line in self.lines:
+            if not line.is_blank:
+                line.get_internal_rhymes()
+        for feature in ['p_rhyme', 'r_rhyme']:
+            self.internal_rhymes[feature] = get_internal_rhymes(self.lines, feature, window)
 
-        # Get line initial and line final schemes for each feature.
-        for feature in features:
-            self.f_rhyme_schemes[feature] = feats_to_scheme([getattr(line.final_word.pronunciations[0], feature)
-                                                             for line in self.lines if line.final_word.pronunciations],
-                                                            True, True)
-            self.i_rhyme_schemes[feature] = feats_to_scheme([getattr(line.initial_word.pronunciations[0], feature)
-                                                             for line in self.lines if line.initial_word.pronunciations],
-                                                            True, True)
+    def print_internal_rhymes(self):
+        tokens = [token.token for line in self.lines for token in line.word_tokens]
+        if self.internal_rhymes.get('p_rhyme'):
+            print_sound_set('Internal Rhyme', self.internal_rhymes['p_rhyme'], tokens)
+        if self.internal_rhymes.get('r_rhyme'):
+            print_sound_set('Internal Rich Rhyme', self.internal_rhymes['r_rhyme'], tokens)
 
     def get_form(self):
         # Create a list of syllables per line.
@@ -61,34 +84,18 @@ class Stanza:
             self.meters = ' '.join(meter_list)
         self.form = name_stanza(self.f_rhyme_schemes.get('p_rhyme'), self.line_lengths, self.meters, len(self.lines))
 
-    def get_sonic_features(self):
-        asso_list, cons_list, bkt_cons_list, str_allit_list, ini_allit_list = [], [], [], [], []
-        # Retrieve lists of sounds from word objects.
-        for token in self.word_tokens:
-            asso_list.append(list(set([pro.str_vowel for pro in token.pronunciations if pro.str_vowel])))
-            cons_list.append(list(set([pro.str_fin_con for pro in token.pronunciations if pro.str_fin_con])))
-            bkt_cons_list.append(list(set([pro.str_bkt_cons for pro in token.pronunciations if pro.str_bkt_cons])))
-            str_allit_list.append(list(set([pro.str_ini_con for pro in token.pronunciations if pro.str_ini_con])))
-            ini_allit_list.append(list(set([pro.word_ini_con for pro in token.pronunciations if pro.word_ini_con])))
-
-        # Get feature groups for rhyme-like features
-        tokens = [token.token for token in self.word_tokens]
-        max_distance = max(self.parent.avg_words_per_line, 5)
-        self.asso = get_sound_set_groups(asso_list, tokens, max_distance)
-        self.cons = get_sound_set_groups(cons_list, tokens, max_distance)
-        self.bkt_cons = get_sound_set_groups(bkt_cons_list, tokens, max_distance)
-        self.str_allit = get_sound_set_groups(str_allit_list, tokens, max_distance)
-        self.ini_allit = get_sound_set_groups(ini_allit_list, tokens, max_distance)
+    # Gets sonic features (assonance, consonance, etc.). groups optionally provides the stanza's groups as (feature,
+    # sound, [word token indexes]) (as streamed by the parent poem); otherwise they are streamed from the stanza's tokens.
+    def get_sonic_features(self, groups=None):
+        if groups is None:
+            max_distance = max(self.parent.avg_words_per_line, 5)
+            groups = iter_sonic_groups(self.word_tokens, config.sonic_features, max_distance)
+        self.sonic_features = {feature: {} for feature in config.sonic_features}
+        for feature, sound, indexes in groups:
+            self.sonic_features[feature].setdefault(sound, []).append(indexes)
 
     def print_sonic_features(self):
         tokens = [token.token for token in self.word_tokens]
-        if self.asso:
-            print_sound_set('Assonance', self.asso, tokens)
-        if self.cons:
-            print_sound_set('Consonance', self.cons, tokens)
-        if self.bkt_cons:
-            print_sound_set('Bracket Consonance', self.bkt_cons, tokens)
-        if self.str_allit:
-            print_sound_set('Stressed Alliteration', self.str_allit, tokens)
-        if self.ini_allit:
-            print_sound_set('Alliteration', self.ini_allit, tokens)
+        for feature, name in config.sonic_features.items():
+            if self.sonic_features.get(feature):
+                print_sound_set(name, self.sonic_features[feature], tokens)
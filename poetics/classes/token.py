@@ -1,6 +1,7 @@
 import re
 
 import poetics.config as config
+from poetics.classes.metrics import Metrics
 
 
 class Token:
@@ -92,6 +93,8 @@ class Token:
                     remove.append(pronunciation)
         for pronunciation in remove:
             self.pronunciations.remove(pronunciation)
+        Metrics.count('culls')
+        Metrics.count('pronunciations_culled', len(remove))
         self.check_features()
 
     # Sets stress tendency based on part of speech.
@@ -113,6 +116,24 @@ class Token:
             else:
                 self.stress_tendency = ['U']
 
+    # Returns the candidate stress patterns for the token, ordered by preference, for use in scansion. Words with
+    # multiple syllables offer the stress patterns of their pronunciations. Single syllable words offer stress overrides
+    # led by their stress tendency, or only their stress tendency if there is no meter to resolve against.
+    def get_stress_candidates(self, metered=True):
+        if len(self.pronunciations[0].stress) > 1:
+            candidates = []
+            for pronunciation in self.pronunciations:
+                if pronunciation.stress not in candidates:
+                    candidates.append(pronunciation.stress)
+            return candidates
+        elif self.stress_tendency == ['S'] or self.stress_tendency == ['W']:
+            return ['1', '0'] if metered else ['1']
+        # Note: words with neutral tendency resolve as unstressed if there is no meter.
+        elif self.stress_tendency == ['U'] or self.stress_tendency == ['N']:
+            return ['0', '1'] if metered else ['0']
+        else:
+            return [self.pronunciations[0].stress]
+
     # Returns None (for punctuation and whitespace), stress_override, or the stress of the first pronunciation.
     def get_stress(self):
         if self.is_punct or self.is_wspace:
@@ -1,5 +1,6 @@
 import logging
 
+from poetics.classes.metrics import Metrics
 from poetics.lookups import get_pronunciations, check_onomatopoetic
 from poetics.classes.pronunciation import Pronunciation
 from poetics.stemmer import stem
@@ -18,6 +19,7 @@ class Word:
             vowels = ['AA', 'AE', 'AH', 'AO', 'AW', 'AX', 'AY', 'EH', 'ER', 'EY', 'IH', 'IX', 'IY', 'OW', 'OY', 'UH',
                       'UW']
             logging.info("Pronunciation for \"%s\" provided as \"%s\"", word, user_pronunciation)
+            Metrics.count('lookups_provided')
             out_pronunciation = []
             f_pronunciations = []
             syllables = user_pronunciation.split('-')
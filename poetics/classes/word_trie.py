@@ -0,0 +1,129 @@
+import logging
+
+import poetics.config as config
+
+
+class WordTrie:
+    def __init__(self, path=config.acrostic_wordlist_path, dictionary=None):
+        # Nested dictionaries of {letter: node}. Nodes that end a word have config.trie_end set to True.
+        self.root = {}
+        self.word_count = 0
+        self.max_length = 0
+        # Dictionary (e.g. an enchant.Dict) that words must be in, in lower case, to be added. None adds every word.
+        self.dictionary = dictionary
+
+        if path:
+            try:
+                with open(path, encoding="utf-8") as file:
+                    for line in file:
+                        self.add(line.strip())
+            except IOError as error:
+                logging.exception("Failed to load wordlist. %s for file %s [Error Number %s].", error.strerror,
+                                  error.filename, error.errno, exc_info=False)
+
+    def __repr__(self) -> str:
+        return '%s (%s words)' % (super().__repr__(), self.word_count)
+
+    def __contains__(self, word):
+        node = self.get_node(word)
+        return bool(node and node.get(config.trie_end))
+
+    # Adds a word to the trie. Only purely alphabetic words are added. Words shorter than config.min_acrostic_word_length
+    # are skipped unless they are in config.short_words (wordlists include letters, initials and abbreviations, but they
+    # aren't words in an acrostic), and longer words are skipped if the trie's dictionary doesn't know them in lower case
+    # (e.g. names).
+    def add(self, word):
+        word = word.lower()
+        if not word.isalpha():
+            return
+        if len(word) < config.min_acrostic_word_length:
+            if word not in config.short_words:
+                return
+        elif self.dictionary is not None and not self.dictionary.check(word):
+            return
+        node = self.root
+        for letter in word:
+            node = node.setdefault(letter, {})
+        if not node.get(config.trie_end):
+            node[config.trie_end] = True
+            self.word_count += 1
+            self.max_length = max(self.max_length, len(word))
+
+    # Returns the node reached by following prefix from the root, or None if no word starts with prefix.
+    def get_node(self, prefix):
+        node = self.root
+        for letter in prefix:
+            node = node.get(letter)
+            if node is None:
+                return None
+        return node
+
+    # Returns the end positions of every word in letters that starts at start, walking the trie only as far as letters
+    # continue some word.
+    def get_word_ends(self, letters, start=0):
+        ends = []
+        node = self.root
+        for index in range(start, len(letters)):
+            node = node.get(letters[index])
+            if node is None:
+                break
+            if node.get(config.trie_end):
+                ends.append(index + 1)
+        return ends
+
+    # Yields every way letters can be split into words (as lists of words), in order of position. Which positions can
+    # be reached from which, and which positions can still reach the end of letters, are worked out once over all
+    # positions, so only readings that complete are ever explored and each reading is produced in time linear in the
+    # length of letters.
+    def iter_segmentations(self, letters):
+        length = len(letters)
+        if not length:
+            return
+        ends = [self.get_word_ends(letters, start) for start in range(length)]
+        # completes[i] is True if letters[i:] can be split into words.
+        completes = [False] * length + [True]
+        for start in range(length - 1, -1, -1):
+            ends[start] = [end for end in ends[start] if completes[end]]
+            completes[start] = bool(ends[start])
+
+        # Depth first search of the remaining positions, with a stack of (position, words so far).
+        stack = [(0, [])]
+        while stack:
+            start, words = stack.pop()
+            if start == length:
+                yield words
+                continue
+            # Reversed so that shorter words are explored (and yielded) first.
+            for end in reversed(ends[start]):
+                stack.append((end, words + [letters[start:end]]))
+
+    # Returns up to max_readings of the ways letters can be split into words. A max_readings of None returns them all.
+    def get_segmentations(self, letters, max_readings=config.max_acrostic_readings):
+        readings = []
+        for reading in self.iter_segmentations(letters):
+            if max_readings is not None and len(readings) >= max_readings:
+                logging.warning("More than %s readings of %s; only the first %s are kept.", max_readings, letters,
+                                max_readings)
+                break
+            readings.append(reading)
+        return readings
+
+    # Returns {name: readings} for a dictionary of {name: letters}, so that many letter sequences can be read against
+    # the same trie at once. Sequences that are identical (e.g. a mesostich that matches the acrostic) are only read
+    # once.
+    def get_batch_segmentations(self, sequences, max_readings=config.max_acrostic_readings):
+        readings = {}
+        by_letters = {}
+        for name, letters in sequences.items():
+            if letters not in by_letters:
+                by_letters[letters] = self.get_segmentations(letters, max_readings)
+            readings[name] = by_letters[letters]
+        return readings
+
+    # Yields (start, end) for every word of min_length or longer found anywhere in letters, i.e. in every window of
+    # letters up to the length of the longest word in the trie.
+    def iter_words(self, letters, min_length=1):
+        for start in range(len(letters)):
+            for end in self.get_word_ends(letters, start):
+                if end - start >= min_length:
+                    yield start, end
@@ -0,0 +1,178 @@
+import argparse
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import time
+
+import coloredlogs
+
+import poetics.config as config
+from poetics.conversions import poem_to_rows
+from poetics.logging import print_metrics
+from poetics.poetics import create_poem, get_poem_files, process_poems, run_outputs
+from poetics.server import serve as run_server
+
+
+########################################################################################################################
+# Commands
+########################################################################################################################
+# Analyzes a single poem file, logging the results, or writing its rows for each export table to stdout as json lines
+# if --format is jsonl.
+def analyze(args):
+    directory, filename = os.path.split(os.path.abspath(args.file))
+    poem = create_poem(filename, args.title, args.author, directory)
+    run_outputs(poem, args.outputs)
+    if args.format == 'jsonl':
+        for table, row in poem_to_rows(poem, 0):
+            print(json.dumps(dict(zip(['table'] + config.export_tables[table], [table] + row))))
+    if args.output:
+        poem.record(args.output)
+    if poem.metrics:
+        print_metrics(poem.metrics)
+
+
+# Analyzes all poems in a directory, as process_poems does. --profile profiles each poem in its worker (see Profiler),
+# writing the merged profile to FILE, or next to the output if no FILE is given.
+def batch(args):
+    profile_path = None
+    if args.profile is not None:
+        profile_path = args.profile or os.path.splitext(args.output)[0] + '.prof'
+    process_poems(args.directory, args.output, args.rhyme_index, args.jobs, args.export, args.format,
+                  not args.full, args.outputs, profile_path)
+
+
+# Rebuilds the json and phoneticized versions of cmudict, its wordlist, and the lexicon-wide rhyme index. The tools are
+# only imported here, as they live in the data directory, which isn't installed as a package.
+def build_lexicon(args):
+    from poetics.data.cmudict import tools
+    tools.process_raw_cmudict()
+    tools.phoneticize_cmudict()
+    tools.pretty_cmudicts()
+    tools.build_rhyme_index()
+
+
+# Times each analysis over the poems in a directory, and reports the time taken and throughput of each.
+def bench(args):
+    files = get_poem_files(args.directory)[:args.limit]
+    stages = ['create'] + args.outputs
+    times = {stage: 0.0 for stage in stages}
+    lines = tokens = 0
+    for file in files:
+        start = time.perf_counter()
+        poem = create_poem(file, directory=args.directory)
+        times['create'] += time.perf_counter() - start
+        for output in args.outputs:
+            start = time.perf_counter()
+            getattr(poem, config.poem_outputs[output])()
+            times[output] += time.perf_counter() - start
+        lines += len([line for line in poem.lines if not line.is_blank])
+        tokens += len(poem.word_tokens)
+
+    print('%s poems, %s lines, %s tokens' % (len(files), lines, tokens))
+    print('%-10s %10s %12s %12s' % ('stage', 'seconds', 'lines/sec', 'tokens/sec'))
+    for stage in stages + ['total']:
+        seconds = sum(times.values()) if stage == 'total' else times[stage]
+        print('%-10s %10.3f %12.1f %12.1f' % (stage, seconds, lines / seconds if seconds else 0,
+                                             tokens / seconds if seconds else 0))
+
+
+# Runs the analysis server.
+def serve(args):
+    run_server(args.host, args.port, args.socket)
+
+
+########################################################################################################################
+# Entry point
+########################################################################################################################
+# Returns a list of outputs from a comma separated string.
+def output_list(value):
+    outputs = [output.strip() for output in value.split(',') if output.strip()]
+    unknown = [output for output in outputs if output not in config.poem_outputs]
+    if unknown:
+        raise argparse.ArgumentTypeError("unknown output(s) %s (valid outputs are %s)"
+                                         % (', '.join(unknown), ', '.join(config.poem_outputs)))
+    return outputs
+
+
+def get_parser():
+    # Options shared by every command.
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--profile', nargs='?', const='', metavar='FILE',
+                        help="profile the command, writing stats to FILE if given and listing the top functions "
+                             "otherwise. batch profiles each poem in its worker, writing the merged stats to FILE "
+                             "(or <output>.prof) along with FILE.collapsed stacks and FILE.poems.json per poem times")
+    common.add_argument('--quiet', action='store_true', help="only log warnings and errors")
+    common.add_argument('--metrics', action='store_true',
+                        help="record the time spent in each stage of analysis and counts of costly events")
+
+    parser = argparse.ArgumentParser(prog='poetics', description="Tools for poetry analysis.")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    command = commands.add_parser('analyze', parents=[common], help="analyze a poem file")
+    command.add_argument('file')
+    command.add_argument('--outputs', type=output_list, default=','.join(config.default_outputs),
+                         help="comma separated analyses to run (default: %(default)s)")
+    command.add_argument('--format', choices=['log', 'jsonl'], default='log',
+                         help="log results, or write them to stdout as json lines")
+    command.add_argument('--title')
+    command.add_argument('--author')
+    command.add_argument('--output', metavar='CSV', help="also record the poem to CSV")
+    command.set_defaults(func=analyze)
+
+    command = commands.add_parser('batch', parents=[common], help="analyze all poems in a directory")
+    command.add_argument('directory', nargs='?', default=config.poem_directory)
+    command.add_argument('--jobs', type=int, default=None, help="number of worker processes")
+    command.add_argument('--outputs', type=output_list, default=','.join(config.default_outputs),
+                         help="comma separated analyses to run (default: %(default)s)")
+    command.add_argument('--format', choices=['jsonl', 'sqlite', 'columnar'], default='jsonl',
+                         help="export format (used with --export)")
+    command.add_argument('--export', metavar='PATH', help="export full results to PATH")
+    command.add_argument('--output', metavar='CSV', default=config.output_file, help="CSV to record poems to")
+    command.add_argument('--rhyme-index', metavar='FILE', help="corpus rhyme index to add poems to")
+    command.add_argument('--full', action='store_true', help="analyze every poem, not only new and modified ones")
+    command.set_defaults(func=batch)
+
+    command = commands.add_parser('build-lexicon', parents=[common],
+                                  help="rebuild the cmudict derived lexicon files and rhyme index")
+    command.set_defaults(func=build_lexicon)
+
+    command = commands.add_parser('bench', parents=[common], help="time each analysis over a directory of poems")
+    command.add_argument('directory', nargs='?', default=config.poem_directory)
+    command.add_argument('--outputs', type=output_list, default=','.join(config.default_outputs),
+                         help="comma separated analyses to time (default: %(default)s)")
+    command.add_argument('--limit', type=int, default=None, help="only time the first LIMIT poems")
+    command.set_defaults(func=bench)
+
+    command = commands.add_parser('serve', parents=[common], help="run the analysis server")
+    command.add_argument('--host', default=config.server_host)
+    command.add_argument('--port', type=int, default=config.server_port)
+    command.add_argument('--socket', metavar='PATH', default=config.server_socket, help="also listen on a Unix socket")
+    command.set_defaults(func=serve)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    config.collect_metrics = config.collect_metrics or args.metrics
+    coloredlogs.install(level='WARNING' if args.quiet else 'INFO', fmt='%(asctime)s: %(message)s', datefmt='%H:%M:%S',
+                        stream=sys.__stdout__ if args.command != 'analyze' or args.format == 'log' else sys.stderr)
+
+    # Batches profile their workers themselves.
+    if args.profile is None or args.command == 'batch':
+        args.func(args)
+        return
+    profile = cProfile.Profile()
+    profile.runcall(args.func, args)
+    if args.profile:
+        profile.dump_stats(args.profile)
+        logging.info("Profile written to %s.", args.profile)
+    else:
+        pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
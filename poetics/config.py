@@ -13,6 +13,47 @@ directory = os.path.dirname(__file__)
 poem_directory = os.path.split(directory)[0] + '/poems'
 # Default output file.
 output_file = os.path.split(directory)[0] + '/output.csv'
+# Column headers of output files.
+record_headers = ['Title', 'Author', '# Lines', '# Words', 'Perfect Rhyme Scheme', '# Internal Rhymes']
+# Column headers of the output of process_poems, which also records the file (relative to the poem directory) that each
+# poem was read from, so that the record can be replaced when the file changes.
+batch_record_headers = record_headers + ['File']
+# Number of rows that are buffered before they are written to output.
+record_batch_size = 50
+# Version of the analysis. Poems recorded by an incremental run with a different version are re-analyzed, so this should
+# be increased whenever a change to the analysis changes its results.
+analysis_version = 1
+# Analyses that can be run on a poem, by name, and the Poem methods that run them.
+poem_outputs = {'rhyme': 'get_rhymes', 'sonic': 'get_sonic_features', 'sight': 'get_sight_features', 'pos': 'get_pos',
+                'scansion': 'get_scansion', 'meter': 'get_meter', 'form': 'get_form'}
+# Analyses run by process_poems (and by default when iterating over poems), in order.
+default_outputs = ['rhyme', 'sonic', 'pos', 'scansion', 'meter', 'form']
+# Number of poems per worker that can be queued or waiting to be consumed when analyzing poems in parallel.
+pending_per_job = 4
+# Address that the analysis server listens on over http, and the Unix socket it also listens on (if any).
+server_host = '127.0.0.1'
+server_port = 8765
+server_socket = None
+# Seconds that the analysis server waits for concurrent requests so that their sentences are parsed together.
+server_batch_wait = 0.005
+# Number of recent requests that the analysis server's latency stats are calculated from.
+server_latency_window = 1000
+# Whether poems record the time spent in each stage of analysis and counts of costly events (as poem.metrics), which
+# process_poems adds up for the whole run.
+collect_metrics = False
+# Seconds of CPU time between the stack samples of profiled batch runs.
+profile_interval = 0.005
+# Number of poems between checkpoints of incremental runs.
+checkpoint_interval = 25
+# Default export directory (or database file, for sqlite exports).
+export_path = os.path.split(directory)[0] + '/export'
+# Default export format: 'jsonl' (a .jsonl file per table), 'sqlite' (a single indexed database), or 'columnar' (a
+# directory per table of column-oriented batch files).
+export_format = 'jsonl'
+# Number of rows per table that are buffered before they are written to an export.
+export_batch_size = 1000
+# Default corpus rhyme index file (maps rhyme keys to the poems and lines they occur in).
+corpus_rhyme_index_file = os.path.split(directory)[0] + '/rhyme_index.json'
 
 # Path of the spacy model to use.
 spacy_model_dir = os.path.join(directory, 'data/spacy/en_core_web_sm')
@@ -23,8 +64,12 @@ cmudict_raw_path = os.path.join(directory, 'data/cmudict/cmudict.txt')
 cmudict_path = os.path.join(directory, 'data/cmudict/cmudict.json')
 # Path of cmudict wordlist (used by pyEnchant).
 cmudict_wordlist_path = os.path.join(directory, 'data/cmudict/wordlist.txt')
+# Path of the wordlist that acrostics are read from.
+acrostic_wordlist_path = cmudict_wordlist_path
 # Path of phoneticized version of cmudict.
 cmudict_phonetic_path = os.path.join(directory, 'data/cmudict/phoneticized.json')
+# Path of the lexicon-wide rhyme index built from the phoneticized version of cmudict.
+rhyme_index_path = os.path.join(directory, 'data/cmudict/rhyme_index.json')
 
 # Path of alternate spellings file.
 alt_spellings_path = os.path.join(directory, 'data/alternate_spellings.json')
@@ -106,12 +151,88 @@ short_pos_dict = {
 
 # Pronunciation features to scheme names. Used for naming rhyme schemes generated from a pronunciation feature
 # (i.e., str_vowel, the pronunciation's stressed vowel sound, corresponds to assonance). The value for each entry
-# is the name of the scheme when line-final and then the name of the scheme when line-initial.
+# is the name of the scheme when line-final and then the name of the scheme when line-initial. Near rhyme (n_rhyme) is
+# matched by phonetic distance rather than a single feature.
 rhyme_scheme_names = {'p_rhyme': ('Perfect Rhyme', 'Perfect Head Rhyme'), 'r_rhyme': ('Rich Rhyme', 'Rich Head Rhyme'),
                       'str_vowel': ('Assonance', 'Head Assonance'), 'str_fin_con': ('Consonance', 'Head Consonance'),
                       'str_bkt_cons': ('Bracket Consonance', 'Head Bracket Consonance'),
                       'str_ini_con': ('Alliteration', 'Head Alliteration'),
-                      'word_ini_con': ('Word Initial Alliteration', 'Head Word Initial Alliteration')}
+                      'word_ini_con': ('Word Initial Alliteration', 'Head Word Initial Alliteration'),
+                      'n_rhyme': ('Near Rhyme', 'Near Head Rhyme')}
+
+# Pronunciation features that correspond to rhyme types, in the order in which rhyme is maximized for them.
+rhyme_features = ['p_rhyme', 'r_rhyme', 'str_vowel', 'str_fin_con', 'str_bkt_cons', 'str_ini_con', 'word_ini_con']
+
+# Pronunciation features used for sonic features, and the names of the features they correspond to.
+sonic_features = {'str_vowel': 'Assonance', 'str_fin_con': 'Consonance', 'str_bkt_cons': 'Bracket Consonance',
+                  'str_ini_con': 'Stressed Alliteration', 'word_ini_con': 'Alliteration'}
+
+# Pronunciation features that rhyme indexes are keyed on: perfect rhyme, rich rhyme, stressed vowel, and near rhyme
+# (word ending).
+rhyme_index_types = ['p_rhyme', 'r_rhyme', 'str_vowel', 'n_rhyme']
+
+# Phonetic features of vowels as (height, backness, rounding, diphthong). Height runs from low (0) to high (3), and
+# backness from front (0) to back (2).
+vowel_features = {'AA': (0, 2, 0, 0), 'AE': (0, 0, 0, 0), 'AH': (1, 1, 0, 0), 'AO': (1, 2, 1, 0), 'AW': (0, 1, 1, 1),
+                  'AX': (1, 1, 0, 0), 'AY': (0, 1, 0, 1), 'EH': (1, 0, 0, 0), 'ER': (1, 1, 0, 0), 'EY': (2, 0, 0, 1),
+                  'IH': (2, 0, 0, 0), 'IX': (2, 0, 0, 0), 'IY': (3, 0, 0, 0), 'OW': (2, 2, 1, 1), 'OY': (1, 2, 1, 1),
+                  'UH': (2, 2, 1, 0), 'UW': (3, 2, 1, 0)}
+# Phonetic features of consonants as (place, manner, voicing). Place runs from bilabial (0) through labiodental, dental,
+# alveolar, postalveolar, palatal, and velar to glottal (7). Manner runs from stop (0) through affricate, fricative,
+# nasal, and lateral to approximant (5).
+consonant_features = {'B': (0, 0, 1), 'CH': (4, 1, 0), 'D': (3, 0, 1), 'DH': (2, 2, 1), 'F': (1, 2, 0), 'G': (6, 0, 1),
+                      'HH': (7, 2, 0), 'JH': (4, 1, 1), 'K': (6, 0, 0), 'L': (3, 4, 1), 'M': (0, 3, 1), 'N': (3, 3, 1),
+                      'NG': (6, 3, 1), 'P': (0, 0, 0), 'R': (3, 5, 1), 'S': (3, 2, 0), 'SH': (4, 2, 0), 'T': (3, 0, 0),
+                      'TH': (2, 2, 0), 'V': (1, 2, 1), 'W': (0, 5, 1), 'Y': (5, 5, 1), 'Z': (3, 2, 1), 'ZH': (4, 2, 1)}
+# Maximum distance between the perfect rhyme portions of two pronunciations (see phoneme_distances) for them to be
+# treated as near rhymes.
+near_rhyme_threshold = 0.3
+# Minimum number of phonemes in a word ending shared by two pronunciations for them to be treated as near rhymes.
+near_rhyme_min_ending = 2
+
+# Window within which repeated rhyme keys count as internal rhyme: 'line' (within a line), 'adjacent' (within a line
+# and the line that follows it), or 'caesura' (the word before a line's caesura and the line's final word).
+internal_rhyme_window = 'line'
+# Punctuation that marks a caesura when it falls between words in a line.
+caesura_marks = [',', ';', ':', '.', '!', '?', '-', '—', '–']
+
+# Tables written by exports, and their columns.
+export_tables = {'poems': ['poem_id', 'title', 'author', 'lines', 'words', 'stanzas', 'form', 'rhyme_scheme'],
+                 'stanzas': ['poem_id', 'stanza', 'first_line', 'lines', 'form', 'meters'],
+                 'lines': ['poem_id', 'line_index', 'line_num', 'stanza', 'text', 'syllables', 'stress',
+                           'internal_rhymes'],
+                 'tokens': ['poem_id', 'token_index', 'line_num', 'token', 'lemma', 'pos', 'simple_pos', 'stress',
+                            'syllables', 'p_rhyme'],
+                 'schemes': ['poem_id', 'stanza', 'position', 'rhyme_type', 'scheme'],
+                 'meters': ['poem_id', 'syllables', 'meter', 'repetitions', 'name', 'lines'],
+                 'sonic_groups': ['poem_id', 'feature', 'sound', 'first_token', 'last_token', 'words']}
+# Indexes created on sqlite exports, as {table: [indexed columns, ...]}.
+export_indexes = {'poems': [['poem_id'], ['author'], ['title']],
+                  'stanzas': [['poem_id', 'stanza']],
+                  'lines': [['poem_id', 'line_index']],
+                  'tokens': [['poem_id', 'token_index'], ['token'], ['p_rhyme']],
+                  'schemes': [['poem_id'], ['rhyme_type', 'scheme']],
+                  'meters': [['poem_id'], ['name']],
+                  'sonic_groups': [['poem_id'], ['feature', 'sound']]}
+
+# Minimum length of the words that acrostics and hidden words are read as. Shorter entries of the wordlist (single
+# letters, initials, abbreviations, etc.) are skipped unless they are in short_words.
+min_acrostic_word_length = 3
+# Words shorter than min_acrostic_word_length that are read in acrostics.
+short_words = ['a', 'i', 'ah', 'am', 'an', 'as', 'at', 'ay', 'be', 'by', 'do', 'eh', 'go', 'ha', 'he', 'hi', 'ho', 'if',
+               'in', 'is', 'it', 'lo', 'me', 'my', 'no', 'of', 'oh', 'on', 'or', 'ox', 'so', 'to', 'up', 'us', 'we',
+               'ye']
+# Enchant dictionary that the words of the acrostic wordlist are checked against. As it only knows names capitalized,
+# names (which make up much of cmudict) are skipped. If it isn't installed, the wordlist is used unchecked.
+acrostic_dictionary = 'en_US'
+# Maximum number of readings kept for a single acrostic (None keeps them all).
+max_acrostic_readings = 100
+# Highest letter position (within each line) that mesostichs are read from.
+max_mesostich_position = 5
+# Minimum length of hidden words found across the initial or final letters of lines.
+min_hidden_word_length = 4
+# Key that marks the end of a word in WordTrie nodes.
+trie_end = '$'
 
 # Classical meters
 classic_meters = {'1010011001100101': 'choriamb', '10100101010': 'hendecasyllabe', '10100101011': 'hendecasyllabe',
@@ -195,8 +316,6 @@ spacy_model = spacy.load(spacy_model_dir)
 
 enchant_dictionary = enchant.request_pwl_dict(cmudict_wordlist_path)
 
-enchant_english_dictionary = enchant.Dict("en_US")
-
 with open(cmudict_phonetic_path) as file:
     phoneticized_dict = json.load(file)
 
@@ -209,7 +328,35 @@ poem_forms_stanzaic = poem_forms_file["by_stanza"]
 with open(stanza_forms_path) as file:
     stanza_forms = json.load(file)
 
+# Forms indexed by line count, with the rhyme schemes, syllable arrangements and meters of each form as sets so that
+# candidate forms can be looked up and matched without scanning the full lists.
+poem_forms_by_length = {}
+for poem_form in poem_forms:
+    poem_forms_by_length.setdefault(poem_form[3], []).append((poem_form[0], frozenset(poem_form[1]),
+                                                              frozenset(poem_form[2])))
+stanza_forms_by_length = {}
+for stanza_form in stanza_forms:
+    stanza_forms_by_length.setdefault(stanza_form[4], []).append((stanza_form[0], frozenset(stanza_form[1]),
+                                                                  frozenset(stanza_form[2]), frozenset(stanza_form[3])))
+
 with open(sonic_features_path) as file:
     sonic_features_file = json.load(file)
 word_endings = sonic_features_file["endings"]
+# Number of phonemes in each word ending, keyed by the ending's identifier.
+word_ending_lengths = {ending: len(phonemes.split()) for phonemes, ending in word_endings.items()}
+
+# Distances (from 0 to 1) between every pair of phonemes, precomputed from their phonetic features. Vowels and
+# consonants are always a distance of 1 apart.
+phoneme_distances = {}
+for phoneme1, features1 in [*vowel_features.items(), *consonant_features.items()]:
+    for phoneme2, features2 in [*vowel_features.items(), *consonant_features.items()]:
+        if phoneme1 in vowel_features and phoneme2 in vowel_features:
+            scales = (3, 2, 1, 1)
+        elif phoneme1 in consonant_features and phoneme2 in consonant_features:
+            scales = (7, 5, 1)
+        else:
+            phoneme_distances[(phoneme1, phoneme2)] = 1
+            continue
+        phoneme_distances[(phoneme1, phoneme2)] = sum([abs(feature1 - feature2) / scale for feature1, feature2, scale
+                                                       in zip(features1, features2, scales)]) / len(scales)
 onomatopoetic_words = sonic_features_file["onomatopoeia"]
\ No newline at end of file
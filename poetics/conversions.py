@@ -1,6 +1,6 @@
 import re
 
-from collections import Counter, OrderedDict
+from collections import OrderedDict, deque
 
 from poetics.patterning import assign_letters_to_dict
 
@@ -112,9 +112,10 @@ def full_tokenize(text):
              'Mrs\.|'
              'Ms\.|')
 
-    # Pattern that splits tokens.
-    pattern = ('(' + abbre +
-               '[A-Z](?=\.)|'  # Any capital letter followed by a period.
+    # Pattern that splits tokens. Abbreviations and initials must start a word, so that words ending in them (e.g.
+    # "disco.") aren't split.
+    pattern = ('(\\b(?:' + abbre[:-1] + ')|'
+               '\\b[A-Z](?=\.)|'  # Any capital letter followed by a period.
                '[\'](?=[^\w])|'  # ' followed by a non-word character.
                '(?<=[^\w])\'|'  # ' preceeded by a non-word character.
                '\'\Z|\A\'|'  # ' at the start or end of the text.
@@ -166,23 +167,55 @@ def title_case(text):
 ########################################################################################################################
 # Grouping
 ########################################################################################################################
-# Gets groups from a sound set.
-def get_sound_set_groups(sound_list, tokenized_text, max_feature_distance):
-    # Make a dictionary of sound appearances that are {Sound: [indexes of appearances]}.
-    sound_set = index_unique_strings(sound_list, 2)
-    output_dict = {}
-    # Turn the sets of indexes into groups with a maximum distance between each consequitive member.
-    for key, indexes in sound_set.items():
-        groups = [num for num in get_distance_groups(indexes, max_feature_distance, 3)]
-        # Test to make sure that those index groups correspond to at least two unique words.
-        for index, group in enumerate(groups):
-            words = [tokenized_text[index2].lower() for index2 in group]
-            if len(set(words)) < 2:
-                del(groups[index])
-        # If any groups remain, add them to an output dictionary.
-        if groups:
-            output_dict[key] = groups
-    return output_dict
+# Streams sonic feature groups from a sequence of word tokens, yielding (feature, sound, [indexes]) as soon as a group
+# can no longer be extended. A group is a run of at least min_length tokens sharing a sound, each no more than
+# max_distance tokens from the last, that spans at least two unique words. A ring buffer holds the sounds of the last
+# max_distance tokens, and a group is closed when its last token leaves the buffer, so memory is bounded by
+# max_distance rather than by the number of tokens. Indexes in breaks (e.g. the first tokens of stanzas) close all open
+# groups, so that groups don't cross them.
+def iter_sonic_groups(tokens, features, max_distance, min_length=3, breaks=None):
+    # Open groups by feature, as {sound: ([indexes], [words])}.
+    open_groups = {feature: {} for feature in features}
+    # Holds (index, {feature: sounds}) for the most recent tokens.
+    buffer = deque(maxlen=max_distance + 1)
+
+    # Closes an open group, yielding it if it is long enough and spans at least two unique words.
+    def close(feature, sound):
+        indexes, words = open_groups[feature].pop(sound)
+        if len(indexes) >= min_length and len(set(words)) >= 2:
+            yield feature, sound, indexes
+
+    for index, token in enumerate(tokens):
+        if breaks and index in breaks:
+            for feature in features:
+                for sound in list(open_groups[feature]):
+                    yield from close(feature, sound)
+            buffer.clear()
+        # The oldest token in a full buffer is now out of range, so close any groups that it ends.
+        if len(buffer) == buffer.maxlen:
+            old_index, old_sounds = buffer[0]
+            for feature, sounds in old_sounds.items():
+                for sound in sounds:
+                    if sound in open_groups[feature] and open_groups[feature][sound][0][-1] == old_index:
+                        yield from close(feature, sound)
+        token_sounds = {}
+        for feature in features:
+            sounds = []
+            for pronunciation in token.pronunciations:
+                sound = getattr(pronunciation, feature)
+                if sound and sound not in sounds:
+                    sounds.append(sound)
+                    if sound not in open_groups[feature]:
+                        open_groups[feature][sound] = ([], [])
+                    open_groups[feature][sound][0].append(index)
+                    open_groups[feature][sound][1].append(token.token.lower())
+            token_sounds[feature] = sounds
+        buffer.append((index, token_sounds))
+
+    # Close whatever is still open at the end of the sequence.
+    for feature in features:
+        for sound in list(open_groups[feature]):
+            yield from close(feature, sound)
 
 
 # Yields max-length groups of integers, of min_length or longer, where each consecutive integer in a group is no more
@@ -213,22 +246,14 @@ def get_distance_groups(num_list, distance, min_length=1):
 def index_unique_strings(input_list, min_count=None):
     min_count = min_count or 1
     out = {}
-    if isinstance(input_list[0], list):
-        count = Counter([string for item in input_list for string in item if string])
-        for key in [key for key, value in count.items() if value >= min_count]:
-            # Creates a list of the top-level indexes of the occurances of the present key.
-            indexes = [index for index, item in enumerate(input_list) for string in item if key == string]
-            # Adds the key and its indexes to output.
-            out[key] = indexes
-        return out
-    else:
-        count = Counter([string for string in input_list if string])
-        for key in [key for key, value in count.items() if value >= min_count]:
-            # Creates a list of the top-level indexes of the occurances of the present key.
-            indexes = [index for index, string in enumerate(input_list) if key == string]
-            # Adds the key and its indexes to output.
-            out[key] = indexes
-        return out
+    # Record the top-level index of each appearance of each string in a single pass.
+    for index, item in enumerate(input_list):
+        for string in (item if isinstance(item, list) else [item]):
+            if string:
+                out.setdefault(string, []).append(index)
+    if min_count > 1:
+        out = {key: indexes for key, indexes in out.items() if len(indexes) >= min_count}
+    return out
 
 
 # Takes a list of features and turns it into a scheme.
@@ -247,3 +272,52 @@ def feats_to_scheme(features, lower=False, allow_blanks=False, max_unique=None):
             return None
     # Return joined scheme
     return ''.join([' ' if not feature or feature == ' ' else ordered_features[feature] for feature in features])
+
+
+########################################################################################################################
+# Exporting
+########################################################################################################################
+# Converts an analyzed poem into rows for the tables in config.export_tables. Yields (table, row), where row is a list of
+# values in the order of the table's columns, so that a poem never needs to be held as rows all at once.
+def poem_to_rows(poem, poem_id):
+    stanza_indexes = {line: index for index, stanza in enumerate(poem.stanzas) for line in stanza.lines}
+    lines = [line for line in poem.lines if not line.is_blank]
+
+    yield 'poems', [poem_id, poem.title, poem.author, len(lines), len(poem.word_tokens), len(poem.stanzas),
+                    '; '.join(poem.form) if poem.form else None, poem.f_rhyme_schemes.get('p_rhyme')]
+
+    for index, stanza in enumerate(poem.stanzas):
+        stanza_lines = [line for line in stanza.lines if not line.is_blank]
+        yield 'stanzas', [poem_id, index, stanza_lines[0].num if stanza_lines else None, len(stanza_lines),
+                          '; '.join(stanza.form) if stanza.form else None, stanza.meters]
+        for position, schemes in [('final', stanza.f_rhyme_schemes), ('initial', stanza.i_rhyme_schemes)]:
+            for rhyme_type, scheme in schemes.items():
+                yield 'schemes', [poem_id, index, position, rhyme_type, scheme]
+
+    # Schemes for the poem as a whole have no stanza.
+    for position, schemes in [('final', poem.f_rhyme_schemes), ('initial', poem.i_rhyme_schemes)]:
+        for rhyme_type, scheme in schemes.items():
+            yield 'schemes', [poem_id, None, position, rhyme_type, scheme]
+
+    token_index = 0
+    for index, line in enumerate(poem.lines):
+        stress = ''.join([token.get_stress() or '' for token in line.word_tokens])
+        internal_rhymes = sum([len(groups) for groups in line.internal_rhymes.get('p_rhyme', {}).values()])
+        yield 'lines', [poem_id, index, line.num, stanza_indexes.get(line), str(line).rstrip('\n'), line.syllables,
+                        stress or None, internal_rhymes]
+        for token in line.word_tokens:
+            pronunciation = token.pronunciations[0] if token.pronunciations else None
+            yield 'tokens', [poem_id, token_index, line.num, token.token, ' '.join(token.lemma or []) or None,
+                             token.pos, token.simple_pos, token.get_stress(),
+                             len(pronunciation.syllables) if pronunciation else None,
+                             pronunciation.p_rhyme if pronunciation else None]
+            token_index += 1
+
+    for length, (meter, repetitions, name) in sorted(poem.meters.items()):
+        yield 'meters', [poem_id, length, meter, repetitions, name, len(poem.lines_by_syllable.get(length, []))]
+
+    for feature, sounds in poem.sonic_features.items():
+        for sound, groups in sounds.items():
+            for indexes in groups:
+                yield 'sonic_groups', [poem_id, feature, sound, indexes[0], indexes[-1],
+                                       ' '.join([poem.word_tokens[index].token for index in indexes])]
@@ -3,6 +3,7 @@ import logging
 import re
 
 import poetics.config as config
+from poetics.classes.pronunciation import Pronunciation
 from poetics.data.cmudict.syllabify.syllabifier import load_language, stringify, syllabify
 
 
@@ -117,7 +118,37 @@ def pretty_cmudicts():
         f.write(re.sub('\]\]\],', ']]],\n', raw_phonetic))
 
 
+# Builds an inverted index of the phoneticized version of cmudict that groups words by their perfect rhyme, rich rhyme,
+# stressed vowel and near rhyme (word ending) keys. Also records the keys of each word, so that lookups of the words
+# that rhyme with a given word don't need to build pronunciations.
+def build_rhyme_index():
+    with open(config.cmudict_phonetic_path, encoding="utf-8") as f:
+        phoneticized_dict = json.load(f)
+
+    index = {rhyme_type: {} for rhyme_type in config.rhyme_index_types}
+    words = {}
+    for word, pronunciations in phoneticized_dict.items():
+        word_keys = {rhyme_type: [] for rhyme_type in config.rhyme_index_types}
+        for pronunciation in pronunciations:
+            pronunciation = Pronunciation(pronunciation)
+            for rhyme_type in config.rhyme_index_types:
+                for key in pronunciation.get_rhyme_keys(rhyme_type):
+                    if key not in word_keys[rhyme_type]:
+                        word_keys[rhyme_type].append(key)
+                        index[rhyme_type].setdefault(key, []).append(word)
+        words[word] = word_keys
+
+    for rhyme_type in index:
+        for key in index[rhyme_type]:
+            index[rhyme_type][key].sort()
+    index['words'] = words
+
+    with open(config.rhyme_index_path, 'w', encoding="utf-8") as f:
+        json.dump(index, f, sort_keys=True, separators=(',', ':'))
+
+
 if __name__ == "__main__":
     process_raw_cmudict()
     phoneticize_cmudict()
     pretty_cmudicts()
+    build_rhyme_index()
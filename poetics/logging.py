@@ -115,3 +115,13 @@ def print_sound_set(name, feature, tokenized_text):
         logging.info(sset)
 
 
+# Logs metrics (see Metrics): the wall and CPU time of each stage, slowest first, and the counters.
+def print_metrics(metrics):
+    header2('Metrics')
+    wall_total, cpu_total = metrics.get_total()
+    logging.info('%s poems, %.3fs wall, %.3fs CPU', metrics.poems, wall_total, cpu_total)
+    for stage, (wall, cpu) in sorted(metrics.times.items(), key=lambda item: item[1][0], reverse=True):
+        logging.info('%-12s %9.3fs wall %9.3fs CPU %5.1f%%', stage, wall, cpu,
+                     wall / wall_total * 100 if wall_total else 0)
+    for name, count in sorted(metrics.counters.items()):
+        logging.info('%-24s %s', name, count)
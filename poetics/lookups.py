@@ -1,9 +1,15 @@
+import json
 import logging
 import re
+import threading
+from functools import lru_cache
 
+import enchant
 from Levenshtein import distance
 
 from poetics import config as config
+from poetics.classes.metrics import Metrics
+from poetics.classes.word_trie import WordTrie
 
 
 ########################################################################################################################
@@ -66,6 +72,8 @@ def get_pronunciations(token):
     else:
         word = token
     pronunciations = phonetic_dict(word)
+    if pronunciations:
+        Metrics.count('lookups_cmudict')
     # If we don't get a working word from cmudict, see if we have a depluralized version of the word.
     if not pronunciations:
         base_pronunciations = None
@@ -86,6 +94,7 @@ def get_pronunciations(token):
                     used_word = word[:-2]
         if base_pronunciations:
             pronunciations = build_plural_or_posessive(base_pronunciations)
+            Metrics.count('lookups_' + transformation_type.split()[0])
             logging.warning('Reading \"%s\" as the %s form of \"%s\".', word, transformation_type, used_word)
     # If that hasn't worked, attempt to deal with elision:
     if not pronunciations:
@@ -93,11 +102,13 @@ def get_pronunciations(token):
             elided = build_elided(word)
             if elided[0]:
                 pronunciations = elided[0]
+                Metrics.count('lookups_elided')
                 logging.warning('Reading \"%s\" as an elided form of \"%s\".', word, elided[1])
     # If we are still without a pronunciation, have Enchant (spellchecker) try to find a recognized word.
     # Using a dictionary which is a list of words in cmudict so it only suggests pronouncable words.
     if not pronunciations:
         potentials = config.enchant_dictionary.suggest(word)
+        Metrics.count('enchant_calls')
         # Handles a strange bug with PyEnchant appending carriage returns to suggestions.
         for index, potential in enumerate(potentials):
             potentials[index] = potential.strip()
@@ -116,6 +127,7 @@ def get_pronunciations(token):
         # If PyEnchant returns an empty list of suggestions then log that.
         else:
             logging.error('Found no valid suggestions for \"%s\".', word)
+        Metrics.count('lookups_enchant' if pronunciations else 'lookups_unresolved')
     return pronunciations
 
 
@@ -175,10 +187,60 @@ def build_elided(word):
     return pronunciation, elided_word
 
 
+########################################################################################################################
+# Rhyme index
+########################################################################################################################
+# Lexicon-wide rhyme index. Loaded from config.rhyme_index_path the first time it is needed.
+rhyme_index = {}
+
+
+# Loads the lexicon-wide rhyme index if it hasn't been loaded yet. Returns False if the index hasn't been built.
+def load_rhyme_index():
+    if not rhyme_index:
+        try:
+            with open(config.rhyme_index_path, encoding="utf-8") as file:
+                rhyme_index.update(json.load(file))
+        except IOError:
+            logging.error("No rhyme index found at %s. Build it with build_rhyme_index() in "
+                          "poetics/data/cmudict/tools.py.", config.rhyme_index_path)
+            return False
+    return True
+
+
+# Returns the words in the lexicon that have the given key for a rhyme type (one of config.rhyme_index_types).
+def get_rhyme_class(key, rhyme_type='p_rhyme'):
+    if not load_rhyme_index():
+        return []
+    return rhyme_index[rhyme_type].get(key, [])
+
+
+# Returns the keys that a word has for a rhyme type across all of its pronunciations.
+def get_rhyme_keys(word, rhyme_type='p_rhyme'):
+    if not load_rhyme_index():
+        return []
+    word_keys = rhyme_index['words'].get(word.lower())
+    return word_keys[rhyme_type] if word_keys else []
+
+
+# Returns the words in the lexicon that rhyme with a word for a rhyme type (one of config.rhyme_index_types).
+def get_rhyming_words(word, rhyme_type='p_rhyme'):
+    word = word.lower()
+    rhyming_words = []
+    # Words that have already been added (or are the word itself), as a word can share keys across pronunciations.
+    seen = {word}
+    for key in get_rhyme_keys(word, rhyme_type):
+        for match in get_rhyme_class(key, rhyme_type):
+            if match not in seen:
+                seen.add(match)
+                rhyming_words.append(match)
+    return rhyming_words
+
+
 ########################################################################################################################
 # Form identification
 ########################################################################################################################
-# Tries to name a meter based on metrical pattern.
+# Tries to name a meter based on metrical pattern. Memoized, as the same handful of patterns recur across a corpus.
+@lru_cache(maxsize=None)
 def name_meter(pattern):
     classical_name = None
     foot = None
@@ -261,18 +323,22 @@ def name_stanza(rhyme_scheme, line_lengths, meters, line_count):
         line_lengths = str(line_lengths[0])
     else:
         line_lengths = ' '.join(line_lengths)
+    return list(match_stanza_forms(rhyme_scheme, line_lengths, meters, line_count))
 
+
+# Matches a stanza against the stanza forms of the same line count. Memoized on the stanza's features, so repeated
+# stanza shapes across a corpus are only matched once.
+@lru_cache(maxsize=None)
+def match_stanza_forms(rhyme_scheme, line_lengths, meters, line_count):
     matches = []
-    # Make a list of forms that are an appropriate number of lines.
-    forms = [forms for forms in config.stanza_forms if forms[4] == line_count]
-    for form in forms:
+    for name, rhyme_schemes, syllables, form_meters in config.stanza_forms_by_length.get(line_count, []):
         # If the form has no rhyme requirement or the stanza's rhyme scheme matches.
-        if not form[1] or rhyme_scheme in form[1]:
+        if not rhyme_schemes or rhyme_scheme in rhyme_schemes:
             # If the form has no line length requirements or we have a match.
-            if not form[2] or line_lengths in form[2]:
+            if not syllables or line_lengths in syllables:
                 # If the form has no metrical requirement or we have a match.
-                if not form[3] or meters in form[3]:
-                    matches.append(form[0])
+                if not form_meters or meters in form_meters:
+                    matches.append(name)
     if not matches:
         if 1 < line_count < 9:
             matches.append('Unrecognized ' + config.stanza_length_names[line_count - 1])
@@ -280,7 +346,7 @@ def name_stanza(rhyme_scheme, line_lengths, meters, line_count):
             matches.append('Unrecognized ' + config.stanza_length_names[line_count - 1] + ' line stanza')
         else:
             matches.append('Unrecognized stanza')
-    return matches
+    return tuple(matches)
 
 
 # Attempts to name the form of a poem based on rhyme scheme, line lengths, and line count.
@@ -293,112 +359,181 @@ def name_poem(rhyme_scheme, line_lengths, line_count):
         line_lengths = str(line_lengths[0])
     else:
         line_lengths = ' '.join(line_lengths)
+    return list(match_poem_forms(rhyme_scheme, line_lengths, line_count))
+
 
+# Matches a poem against the poem forms of the same line count. Memoized on the poem's features.
+@lru_cache(maxsize=None)
+def match_poem_forms(rhyme_scheme, line_lengths, line_count):
     matches = []
     # Get all possible forms that are the right length.
-    forms = [form for form in config.poem_forms if form[3] == line_count]
-    forms.extend(get_repeating_rhyme_patterns(line_count))
-    for form in forms:
+    for name, rhyme_schemes, syllables in config.poem_forms_by_length.get(line_count, []):
+        # If the form has no rhyme requirement or the poem's rhyme scheme matches.
+        if not rhyme_schemes or rhyme_scheme in rhyme_schemes:
+            # If the form has no line length requirements or we have a match.
+            if not syllables or line_lengths in syllables:
+                matches.append(name)
+
+    # Split the rhyme scheme and line lengths into per-line values for comparison with repeating forms.
+    scheme = re.findall('[A-Z][a-z]*', rhyme_scheme) if rhyme_scheme else None
+    lengths = line_lengths.split()
+    if len(lengths) == 1:
+        lengths = lengths * line_count
+    # Repeating forms are generated lazily and compared line by line, stopping at the first mismatch.
+    for index, form in enumerate(config.poem_forms_repeating):
+        rhyme_repetitions, syllable_repetitions = get_repetitions(form, line_count)
+        if rhyme_repetitions is None:
+            continue
         # If the form has no rhyme requirement or the poem's rhyme scheme matches.
-        if not form[1] or rhyme_scheme in form[1]:
+        if not form[2] or (scheme and match_sequence(scheme, iter_repeating_rhymes(index, rhyme_repetitions))):
             # If the form has no line length requirements or we have a match.
-            if not form[2] or line_lengths in form[2]:
+            if not form[5] or match_sequence(lengths, iter_repeating_syllables(form, syllable_repetitions)):
                 matches.append(form[0])
-    return matches
-
-
-# Takes a poem's line count and builds a list of the repeating poem forms that could match a poem of that length
-def get_repeating_rhyme_patterns(poem_lines):
-    out_forms = []
-    alphabet = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S', 'T', 'U',
-                'V', 'W', 'X', 'Y', 'Z']
-    for form in config.poem_forms_repeating:
-        # Get the length of the head of the pattern if one exists.
-        rhyme_head = len([character for character in form[1] if not character.isdigit()])
-        syllables_head = 0
-        if form[4]:
-            syllables_head = len(form[4].split())
-        # Get the length of the tail of the pattern if one exists.
-        rhyme_tail = len([character for character in form[3] if not character.isdigit()])
-        syllables_tail = 0
-        if form[6]:
-            syllables_tail = len(form[6].split())
-        # Get the length of the core repeated portion.
-        rhyme_core = len([character for character in form[2] if not character.isdigit()])
-        syllables_core = 0
-        if form[5]:
-            syllables_core = len(form[5].split())
-        # Number of lines left after we remove the length of the head/tail.
-        poem_remaining_lines = poem_lines - (rhyme_head or syllables_head) - (rhyme_tail or syllables_tail)
-        # If the pattern can fit, then repeat the repeating portions to achieve the appropriate length.
-        if poem_remaining_lines % (rhyme_core or syllables_core) == 0:
-            out_rhyme_pattern = []
-            out_syllable_pattern = []
-            # If there is a syllables_core, then deal with repeating the syllable counts.
-            if syllables_core > 0:
-                out_syllable_pattern.extend(form[4])
-                for i in range(0, (poem_remaining_lines // syllables_core)):
-                    out_syllable_pattern.append(form[5])
-                out_syllable_pattern.extend(form[6])
-            # If there is a rhyme_core, then deal with repeating it (with interlocking).
-            if rhyme_core > 0:
-                split_repeat = re.findall('([a-zA-Z]\d?)', form[2])
-                alphabet_count = 0
-                current_alphabet = alphabet[:]
-                # Remove letters in the first instance of the pattern from the currently used alphabet.
-                for letter in [letter.upper() for letter in set([pos[0] for pos in split_repeat])]:
-                    current_alphabet.remove(letter)
-                # Add the head and then the letters from the first instance to out_pattern.
-                out_rhyme_pattern.extend(form[1])
-                out_rhyme_pattern.extend([letter[0].upper() for letter in split_repeat])
-                poem_remaining_lines -= len(split_repeat)
-                last_repeat = []
-                # Repeat the core pattern the appropriate number of times.
-                for i in range(0, (poem_remaining_lines // len(split_repeat))):
-                    next_input = split_repeat[:]
-                    for index, pos in enumerate(next_input):
-                        if pos[-1:].isdigit():
-                            if last_repeat:
-                                next_input[index] = last_repeat[int(pos[-1:]) - 1].upper()
-                            else:
-                                next_input[index] = split_repeat[int(pos[-1:]) - 1].upper()
-                        elif pos.islower():
-                            replacements = [index2 for index2, item in enumerate(split_repeat) if item == pos]
-                            for replacement in replacements:
-                                next_input[replacement] = current_alphabet[0]
-                            current_alphabet.remove(current_alphabet[0])
-                        # If we have used all of the letters, we starting using Aa Ab ... Ba ... Aaa.
-                        if not current_alphabet:
-                            prime_letter = alphabet[alphabet_count % 26]
-                            for letter in alphabet:
-                                current_alphabet.append(prime_letter + letter.lower() * ((alphabet_count // 26) + 1))
-                            alphabet_count += 1
-                    last_repeat = next_input[:]
-                    out_rhyme_pattern.extend(next_input)
-                # Handle the tail if we have one.
-                if form[3]:
-                    split_tail = re.findall('([a-zA-Z]\d?)', form[3])
-                    for index, pos in enumerate(split_tail):
-                        if pos[-1:].isdigit():
-                            split_tail[index] = last_repeat[int(pos[-1:]) - 1].upper()
-                        elif pos.islower():
-                            replacements = [index2 for index2, item in enumerate(split_tail) if item == pos]
-                            for replacement in replacements:
-                                split_tail[replacement] = current_alphabet[0]
-                            current_alphabet.remove(current_alphabet[0])
-                        if not current_alphabet:
-                            prime_letter = alphabet[alphabet_count % 26]
-                            for letter in alphabet:
-                                current_alphabet.append(prime_letter + letter.lower() * ((alphabet_count // 26) + 1))
-                            alphabet_count += 1
-                    out_rhyme_pattern.extend(split_tail)
-            if out_rhyme_pattern:
-                out_rhyme_pattern = [''.join(out_rhyme_pattern)]
-            else:
-                out_rhyme_pattern = []
-            if out_syllable_pattern:
-                out_syllable_pattern = ' '.join(out_syllable_pattern)
-            else:
-                out_syllable_pattern = []
-            out_forms.append([form[0], out_rhyme_pattern, out_syllable_pattern, poem_lines])
-    return out_forms
+    return tuple(matches)
+
+
+# Hits on the cached meter and form lookups are counted in poem metrics.
+Metrics.cached_functions.extend([name_meter, match_stanza_forms, match_poem_forms])
+
+
+# Returns the number of repetitions of the rhyme core and syllables core of a repeating form that fill a poem of the
+# given line count, or (None, None) if the form can't fit.
+def get_repetitions(form, poem_lines):
+    # Get the length of the head, core, and tail of the rhyme and syllable patterns if they exist.
+    rhyme_head = len([character for character in form[1] if not character.isdigit()])
+    rhyme_core = len([character for character in form[2] if not character.isdigit()])
+    rhyme_tail = len([character for character in form[3] if not character.isdigit()])
+    syllables_head = len(form[4].split())
+    syllables_core = len(form[5].split())
+    syllables_tail = len(form[6].split())
+    # Number of lines left after we remove the length of the head/tail.
+    poem_remaining_lines = poem_lines - (rhyme_head or syllables_head) - (rhyme_tail or syllables_tail)
+    core = rhyme_core or syllables_core
+    if not core or poem_remaining_lines <= 0 or poem_remaining_lines % core:
+        return None, None
+    return poem_remaining_lines // (rhyme_core or core), poem_remaining_lines // (syllables_core or core)
+
+
+# Checks a list of values against a (lazily generated) sequence of symbols. Stops at the first mismatch.
+def match_sequence(values, symbols):
+    position = 0
+    for symbol in symbols:
+        if position >= len(values) or not values[position] == symbol:
+            return False
+        position += 1
+    return position == len(values)
+
+
+# Yields the syllables per line of a repeating form: its head, then the given number of repetitions of its core, then
+# its tail.
+def iter_repeating_syllables(form, repetitions):
+    yield from form[4].split()
+    for i in range(0, repetitions):
+        yield from form[5].split()
+    yield from form[6].split()
+
+
+# Yields the rhyme scheme of the repeating form at form_index in config.poem_forms_repeating one line at a time: its
+# head, then the given number of repetitions of its (interlocking) core, then its tail.
+def iter_repeating_rhymes(form_index, repetitions):
+    form = config.poem_forms_repeating[form_index]
+    yield from form[1]
+    for i in range(0, repetitions):
+        yield from get_repeating_core(form_index, i)
+    # Handle the tail if we have one, using the letters that follow the final repetition.
+    if form[3] and repetitions:
+        cached = repeating_rhyme_cache[form_index]
+        yield from expand_rhyme_segment(cached['tail'], cached['repeats'][repetitions - 1], cached['letters'],
+                                        cached['used'][repetitions - 1])[0]
+
+
+# Expanded repetitions of the rhyme cores of repeating forms, keyed by index in config.poem_forms_repeating. Each entry
+# stores the split core and tail, the letters available for new rhymes, each expanded repetition, and the number of
+# new letters used up to and including each repetition. Repetitions are only ever expanded once per form, so long poems
+# reuse (and extend) the prefix expanded for earlier poems. Entries are only built and extended while holding
+# repeating_rhyme_lock, as poems may be analyzed in several threads at once (e.g. by the analysis server).
+repeating_rhyme_cache = {}
+repeating_rhyme_lock = threading.Lock()
+
+
+# Returns the given repetition (counting from 0) of the rhyme core of a repeating form, expanding and caching any
+# repetitions up to it that haven't been expanded yet.
+def get_repeating_core(form_index, repetition):
+    with repeating_rhyme_lock:
+        if form_index not in repeating_rhyme_cache:
+            form = config.poem_forms_repeating[form_index]
+            split_repeat = re.findall('([a-zA-Z]\d?)', form[2])
+            # The letters in the first instance of the pattern are removed from the letters available for new rhymes.
+            first_letters = set([pos[0].upper() for pos in split_repeat])
+            repeating_rhyme_cache[form_index] = {
+                'core': split_repeat,
+                'tail': re.findall('([a-zA-Z]\d?)', form[3]),
+                'letters': [letter for letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ' if letter not in first_letters],
+                'repeats': [tuple([pos[0].upper() for pos in split_repeat])],
+                'used': [0]}
+        cached = repeating_rhyme_cache[form_index]
+        while len(cached['repeats']) <= repetition:
+            next_repeat, used = expand_rhyme_segment(cached['core'], cached['repeats'][-1], cached['letters'],
+                                                     cached['used'][-1])
+            cached['repeats'].append(next_repeat)
+            cached['used'].append(used)
+        return cached['repeats'][repetition]
+
+
+# Expands a split segment of a repeating rhyme pattern. Capital letters are kept, lower case letters followed by a digit
+# copy the letter at that position in last_repeat, and other lower case letters take the next available letter.
+# Returns the expanded segment and the updated count of used letters.
+def expand_rhyme_segment(segment, last_repeat, letters, used):
+    out_segment = []
+    assigned = {}
+    for pos in segment:
+        if pos[-1:].isdigit():
+            out_segment.append(last_repeat[int(pos[-1:]) - 1])
+        elif pos.islower():
+            if pos not in assigned:
+                assigned[pos] = get_scheme_letter(used, letters)
+                used += 1
+            out_segment.append(assigned[pos])
+        else:
+            out_segment.append(pos)
+    return tuple(out_segment), used
+
+
+# Returns the letter at index in the sequence of letters available for new rhymes. If we have used all of the letters,
+# we start using Aa Ab ... Ba ... Aaa.
+def get_scheme_letter(index, letters):
+    if index < len(letters):
+        return letters[index]
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    prime_count, letter_index = divmod(index - len(letters), 26)
+    return alphabet[prime_count % 26] + alphabet[letter_index].lower() * ((prime_count // 26) + 1)
+
+
+########################################################################################################################
+# Word trie
+########################################################################################################################
+# Trie of the words in config.acrostic_wordlist_path. Built the first time it is needed.
+word_trie = None
+
+
+# Returns the word trie, building it if it hasn't been built yet. Words are checked against config.acrostic_dictionary
+# where it is installed.
+def get_word_trie():
+    global word_trie
+    if word_trie is None:
+        try:
+            dictionary = enchant.Dict(config.acrostic_dictionary)
+        except enchant.errors.DictNotFoundError:
+            logging.warning("The %s dictionary isn't installed, so names aren't skipped in acrostics.",
+                            config.acrostic_dictionary)
+            dictionary = None
+        word_trie = WordTrie(config.acrostic_wordlist_path, dictionary)
+    return word_trie
+
+
+########################################################################################################################
+# Parsing
+########################################################################################################################
+# Returns spaCy docs for a list of texts, parsed together in a single pass of the model.
+def parse_texts(texts):
+    return list(config.spacy_model.pipe(texts))
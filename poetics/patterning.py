@@ -1,6 +1,7 @@
-from collections import Counter
+from collections import Counter, OrderedDict, deque
 
 from poetics import config as config
+from poetics.classes.metrics import Metrics
 
 
 ########################################################################################################################
@@ -32,9 +33,14 @@ def assign_letters_to_dict(ordered_dict, lower=False):
     for index, feature in enumerate(ordered_dict):
         if index < 26:
             ordered_dict[feature] = keys[index]
-        # If we have more than 26 rhymes, we starting using Aa Ab ... Ba ... Aaa.
+        # If we have more than 26 rhymes, we starting using Aa Ab ... Ba ... Zz Aaa Aab ...
         else:
-            ordered_dict[feature] = keys[(index // 26) - 1] + keys2[index % 26]
+            letters = keys2[index % 26]
+            number = index // 26 - 1
+            while number >= 26:
+                letters = keys2[number % 26] + letters
+                number = number // 26 - 1
+            ordered_dict[feature] = keys[number] + letters
     return ordered_dict
 
 
@@ -191,6 +197,48 @@ def check_meters(length, predicted, predicted_single):
         return predicted_merged, ''
 
 
+# Finds the best joint assignment of stress patterns for a line. token_candidates is a list (one entry per word token)
+# of lists of candidate stress patterns. Each candidate is scored by the number of its positions that match template,
+# and the lattice of (token, syllable position) states is decoded in a single pass. Returns the index of the chosen
+# candidate for each token.
+# Note: on ties the earlier candidate is kept, so candidates should be ordered by preference.
+def decode_scansion(token_candidates, template):
+    # Maps syllable positions reachable after the current token to (score, back pointer). Back pointers are stored as
+    # (previous position, candidate index) per token in back_pointers.
+    states = {0: 0}
+    back_pointers = []
+    for candidates in token_candidates:
+        next_states = {}
+        pointers = {}
+        for position, score in states.items():
+            for index, stress in enumerate(candidates):
+                matches = 0
+                for offset, character in enumerate(stress):
+                    if position + offset < len(template) and template[position + offset] == character:
+                        matches += 1
+                end = position + len(stress)
+                if end not in next_states or score + matches > next_states[end]:
+                    next_states[end] = score + matches
+                    pointers[end] = (position, index)
+        states = next_states
+        back_pointers.append(pointers)
+    # If nothing got decoded (no tokens), there is nothing to choose.
+    if not back_pointers:
+        return []
+    # Prefer paths that end exactly at the end of the template, otherwise take the best scoring end state.
+    if len(template) in states:
+        position = len(template)
+    else:
+        position = max(states, key=states.get)
+    # Walk the back pointers to recover the chosen candidate for each token.
+    chosen = []
+    for pointers in reversed(back_pointers):
+        position, index = pointers[position]
+        chosen.append(index)
+    chosen.reverse()
+    return chosen
+
+
 ########################################################################################################################
 # Rhyme
 ########################################################################################################################
@@ -213,100 +261,224 @@ def resolve_rhyme(candidates, rhyme_counts, rhyme_counts_mult):
         return None
 
 
-# Attempts to maximize matches across tokens for their values for the feature.
-def maximize_token_matches(tokens, feature):
-    # List of tokens that don't have that feature resolved.
-    unresolved_tokens = [token for token in tokens if not getattr(token, 's_' + feature)]
-
-    # If all of the tokens already have the feature resolved (that is, if all pronunciations assigned to a token
-    # have the same value for the feature), then there's nothing to maximize.
-    if not unresolved_tokens:
-        return
-
-    # Counter for occurances of the feature for tokens that have the feature resolved.
-    count = Counter([getattr(token.pronunciations[0], feature) for token in tokens
-                     if getattr(token, 's_' + feature) and token.pronunciations])
-    # Counter for occurances of the feature for tokens that don't have the feature resolved.
-    multi_count = Counter([getattr(pronunciation, feature) for token in unresolved_tokens
-                           for pronunciation in token.pronunciations])
-
-    # Creates a list of tuples which store the token and the most likely value (for feature) for each unresolved token.
-    best_features = []
-    for token in unresolved_tokens:
-        best_features.append((token, resolve_rhyme([getattr(pronunciation, feature) for pronunciation
-                                                    in token.pronunciations], count, multi_count)))
-
-    # Update our count of resolved token features to include the most likely values we've calculated.
-    count.update([value for token, value in best_features])
-
-    # Threshold for the number of unique values for the feature amongst tokens above which that feature is not
-    # maximized. This is set as half the number of tokens, rounded up. I.e., if we have 16 (or 15) tokens, then if there
-    # are more than 9 unique values then don't consider that feature patterened and don't maximize for it.
-    threshold = (len(tokens) // 2) + (len(tokens) % 2 > 0)
-
-    # If we have more unique values for feature than the threshold, then don't do any maximizing.
-    if len(count) > threshold:
-        return
-    # If some number of tokens had a value for the feature of None, then don't do any maximizing.
-    elif None in count:
-        return
-    # Otherwise, remove pronunciations from the unresolved tokens that don't have the selected value for feature.
+# Extracts a row of feature values from the first pronunciation of each token. Tokens that are None or that have no
+# pronunciations get None in place of a row.
+def get_feature_rows(tokens, features):
+    return [tuple(getattr(token.pronunciations[0], feature) for feature in features)
+            if token and token.pronunciations else None for token in tokens]
+
+
+# Attempts to maximize matches across each group of tokens for their values for each of the features in turn. The
+# feature values of every pronunciation are extracted once into a table, maximization narrows down the rows of the table
+# that remain for each token, and tokens cull their pronunciations once at the end.
+def maximize_rhyme_matches(token_groups, features):
+    # Feature values for each pronunciation of each token, and the indexes of the rows that remain for each token.
+    table = {}
+    remaining = {}
+    for tokens in token_groups:
+        for token in tokens:
+            if token not in table:
+                table[token] = [tuple(getattr(pronunciation, feature) for feature in features)
+                                for pronunciation in token.pronunciations]
+                remaining[token] = list(range(len(table[token])))
+
+    for column, feature in enumerate(features):
+        for tokens in token_groups:
+            # Values of the feature for the remaining pronunciations of each token.
+            values = [[table[token][row][column] for row in remaining[token]] for token in tokens]
+            # Indexes of tokens that don't have the feature resolved (that is, tokens whose remaining pronunciations
+            # don't all have the same value for the feature).
+            unresolved = [index for index, token_values in enumerate(values) if len(set(token_values)) > 1]
+            # If all of the tokens already have the feature resolved, then there's nothing to maximize.
+            if not unresolved:
+                continue
+
+            # Counter for occurances of the feature for tokens that have the feature resolved.
+            count = Counter([token_values[0] for token_values in values if len(set(token_values)) == 1])
+            # Counter for occurances of the feature for tokens that don't have the feature resolved.
+            multi_count = Counter([value for index in unresolved for value in values[index]])
+
+            # Creates a list of tuples which store the index of each unresolved token and its most likely value.
+            best_features = [(index, resolve_rhyme(values[index], count, multi_count)) for index in unresolved]
+
+            # Update our count of resolved token features to include the most likely values we've calculated.
+            count.update([value for index, value in best_features])
+
+            # Threshold for the number of unique values for the feature amongst tokens above which that feature is not
+            # maximized. This is set as half the number of tokens, rounded up. I.e., if we have 16 (or 15) tokens, then
+            # if there are more than 9 unique values then don't consider that feature patterened and don't maximize
+            # for it.
+            threshold = (len(tokens) // 2) + (len(tokens) % 2 > 0)
+
+            # If we have more unique values for feature than the threshold, or if some number of tokens had a value
+            # for the feature of None, then don't do any maximizing.
+            if len(count) > threshold or None in count:
+                continue
+            # Otherwise, drop rows for the unresolved tokens that don't have the selected value for feature.
+            for index, value in best_features:
+                # It is possible for resolve_rhyme to return None, so make sure we have a value before we do anything.
+                if value:
+                    token = tokens[index]
+                    remaining[token] = [row for row in remaining[token] if table[token][row][column] == value]
+
+    # Cull the pronunciations of tokens whose rows were narrowed down (counted as Token.cull_pronunciations counts them).
+    for token, rows in remaining.items():
+        if len(rows) < len(table[token]):
+            Metrics.count('culls')
+            Metrics.count('pronunciations_culled', len(table[token]) - len(rows))
+            token.pronunciations = [token.pronunciations[row] for row in rows]
+            token.check_features()
+
+
+# Returns the distance (from 0 to 1) between two space separated phoneme strings. This is an edit distance where
+# substitutions cost the distance between the phonemes (from config.phoneme_distances) and insertions or deletions cost
+# 1, divided by the length of the longer string.
+def get_phonetic_distance(phonemes1, phonemes2):
+    phonemes1 = phonemes1.split()
+    phonemes2 = phonemes2.split()
+    if not phonemes1 or not phonemes2:
+        return 1 if phonemes1 or phonemes2 else 0
+    previous = [float(index) for index in range(0, len(phonemes2) + 1)]
+    for index1, phoneme1 in enumerate(phonemes1):
+        current = [index1 + 1.0]
+        for index2, phoneme2 in enumerate(phonemes2):
+            substitution = config.phoneme_distances.get((phoneme1, phoneme2), 0 if phoneme1 == phoneme2 else 1)
+            current.append(min(previous[index2] + substitution, previous[index2 + 1] + 1, current[index2] + 1))
+        previous = current
+    return previous[-1] / max(len(phonemes1), len(phonemes2))
+
+
+# Groups pronunciations into clusters of near rhymes. Pronunciations are near rhymes if the distance between their
+# perfect rhyme portions is within config.near_rhyme_threshold, or if they share a word ending (n_rhyme) of at least
+# config.near_rhyme_min_ending phonemes. Each cluster is represented by its first perfect rhyme, and a perfect rhyme joins
+# the first cluster whose representative it is a near rhyme of (or starts a new one), so near rhyme isn't chained: A~B and
+# B~C don't put C with A unless C is also a near rhyme of A. Returns a cluster label (the representative) for each
+# pronunciation (None for missing ones).
+def get_near_rhyme_clusters(pronunciations):
+    # Distances are only computed between distinct perfect rhymes, which are usually far fewer than the pronunciations.
+    keys = list(OrderedDict.fromkeys([pronunciation.p_rhyme for pronunciation in pronunciations if pronunciation]))
+    # The sufficiently long word endings of each perfect rhyme.
+    endings = {key: set() for key in keys}
+    for pronunciation in pronunciations:
+        if pronunciation and pronunciation.n_rhyme:
+            endings[pronunciation.p_rhyme].update([ending for ending in pronunciation.n_rhyme
+                                                   if config.word_ending_lengths.get(ending, 0) >=
+                                                   config.near_rhyme_min_ending])
+
+    representatives = []
+    clusters = {}
+    for key in keys:
+        for representative in representatives:
+            if endings[key] & endings[representative] or \
+                    get_phonetic_distance(key, representative) <= config.near_rhyme_threshold:
+                clusters[key] = representative
+                break
+        else:
+            representatives.append(key)
+            clusters[key] = key
+    return [clusters[pronunciation.p_rhyme] if pronunciation else None for pronunciation in pronunciations]
+
+
+# Extracts rows of rhyme feature values for tokens (as get_feature_rows does), with the near rhyme cluster of each
+# token's first pronunciation appended as a final column (n_rhyme), so that the columns are features + ['n_rhyme'].
+def get_rhyme_rows(tokens, features):
+    rows = get_feature_rows(tokens, features)
+    clusters = get_near_rhyme_clusters([token.pronunciations[0] if row else None for token, row in zip(tokens, rows)])
+    return [row + (cluster,) if row else None for row, cluster in zip(rows, clusters)]
+
+
+# Finds internal rhymes amongst the word tokens of a list of lines: word tokens whose first pronunciations share a
+# value for feature (p_rhyme or r_rhyme) within a window (see config.internal_rhyme_window). Repetitions of the same word
+# and end rhymes (two line-final words) are not counted. Returns a dictionary of {rhyme key: [groups of indexes]}, where
+# indexes refer to the word tokens of all of the lines in order.
+def get_internal_rhymes(lines, feature='p_rhyme', window=config.internal_rhyme_window):
+    # Each word token along with the index of its line, its key for the feature, and whether it is line-final.
+    entries = []
+    for line_index, line in enumerate(lines):
+        for token in line.word_tokens:
+            key = getattr(token.pronunciations[0], feature) if token.pronunciations else None
+            entries.append((line_index, token, key, token is line.final_word))
+
+    groups = []
+    # Internal rhyme at the caesura: the last word before a caesura rhymes with the final word of the line.
+    if window == 'caesura':
+        position = 0
+        for line in lines:
+            caesura = None
+            for token in line.tokens:
+                if token.is_punct and token.token in config.caesura_marks and caesura is not None:
+                    break
+                elif not token.is_punct and not token.is_wspace:
+                    caesura = 0 if caesura is None else caesura + 1
+            # If we broke out of the loop before the final word, caesura indexes the word before the caesura.
+            if caesura is not None and caesura < len(line.word_tokens) - 1:
+                caesura_entry = entries[position + caesura]
+                final_entry = entries[position + len(line.word_tokens) - 1]
+                if caesura_entry[2] and caesura_entry[2] == final_entry[2] \
+                        and not caesura_entry[1].token.lower() == final_entry[1].token.lower():
+                    groups.append([position + caesura, position + len(line.word_tokens) - 1])
+            position += len(line.word_tokens)
+    # Otherwise, slide a window over the word tokens keeping a hash map of the latest position of each key within it.
     else:
-        for token, value in best_features:
-            # It is possible for resolve_rhyme to return None, so make sure we have a value before we do anything.
-            if value:
-                token.cull_pronunciations(feature, value)
+        span = 1 if window == 'adjacent' else 0
+        latest = {}
+        in_window = deque()
+        group_indexes = {}
+        for position, (line_index, token, key, is_final) in enumerate(entries):
+            # Drop positions that have fallen out of the window.
+            while in_window and entries[in_window[0]][0] < line_index - span:
+                old_position = in_window.popleft()
+                if latest.get(entries[old_position][2]) == old_position:
+                    del latest[entries[old_position][2]]
+            if not key:
+                continue
+            if key in latest:
+                previous = latest[key]
+                if not (is_final and entries[previous][3]) \
+                        and not token.token.lower() == entries[previous][1].token.lower():
+                    if previous not in group_indexes:
+                        group_indexes[previous] = len(groups)
+                        groups.append([previous])
+                    group_indexes[position] = group_indexes[previous]
+                    groups[group_indexes[previous]].append(position)
+            latest[key] = position
+            in_window.append(position)
+
+    internal_rhymes = {}
+    for group in groups:
+        internal_rhymes.setdefault(entries[group[0]][2], []).append(group)
+    return internal_rhymes
 
 
 ########################################################################################################################
 # Sight
 ########################################################################################################################
 
-def get_acrostics(input_string):
-    def find_next_word(letters):
-        c = 1
-        words = []
-        # All single letters are in the dictionary, but they aren't words, so if the first letter isn't 'a' or 'i' then
-        # skip matching the first letter.
-        if not letters[0] == 'a' and not letters[0] == 'i':
-            if len(letters) > 1:
-                c += 1
-            # If we don't have a next letter to skip to, then stop.
-            else:
-                return words
-        # Loop through the input string in segments of increasing length checking if any are words. Add matched words to
-        # words, which is the output.
-        while c <= len(letters):
-            if config.enchant_english_dictionary.check(letters[:c]):
-                words.append(letters[:c])
-            c += 1
-        return words
-
-    final_readings = []
-    # Create a list of the words that could start an accrostic.
-    readings = [[word] for word in find_next_word(input_string)]
-    # Keep looping until we run out of readings.
-    while readings:
-        for index, reading in enumerate(readings):
-            # If the current reading is the length of the entire input string, then add it to output and remove it from
-            # readings.
-            if len(''.join(reading)) == len(input_string):
-                final_readings.append(reading)
-                del readings[index]
-                continue
-            # Get the set of next possible words for the string remaining when it has been trimmed to reflect the
-            # current words in reading.
-            next_words = find_next_word(input_string[len(''.join(reading)):])
-            # If we got no words, then delete the current reading as it cannot be completed.
-            if len(next_words) == 0:
-                del readings[index]
-            # If we got a single word, then add it to the end of the current reading.
-            elif len(next_words) == 1:
-                readings[index].append(next_words[0])
-            # If we got multiple words, split the reading off into multiple readings that continue from each.
-            elif len(next_words) >= 1:
-                current = reading[:]
-                readings[index].append(next_words[0])
-                for word in next_words[1:]:
-                    readings.append(current + [word])
-    return final_readings
+# Returns {name: letters} for the letter sequences that acrostic-like readings are taken from, given a list of line texts:
+# the first letter of each line (acrostic), the last letter of each line (telestich), the Nth letter of each line for
+# each N from 2 to max_position (mesostich), and the Nth letter of the Nth line (diagonal). Only letters are counted,
+# and mesostichs and diagonals are skipped if any line is too short to have the letter they need.
+def get_sight_sequences(lines, max_position=config.max_mesostich_position):
+    lines = [''.join([char for char in line.lower() if char.isalpha()]) for line in lines]
+    lines = [line for line in lines if line]
+    sequences = OrderedDict()
+    if not lines:
+        return sequences
+    sequences['Acrostic'] = ''.join([line[0] for line in lines])
+    sequences['Telestich'] = ''.join([line[-1] for line in lines])
+    for position in range(2, max_position + 1):
+        if all([len(line) >= position for line in lines]):
+            sequences['Mesostich (Letter %s)' % position] = ''.join([line[position - 1] for line in lines])
+    if all([len(line) > index for index, line in enumerate(lines)]):
+        sequences['Diagonal'] = ''.join([line[index] for index, line in enumerate(lines)])
+    return sequences
+
+
+# Returns the words of min_length or longer hidden in a sequence of letters (e.g. the initial letters of lines), as
+# (index of first letter, word). Words that lie within a longer hidden word (e.g. 'tear' in 'tears') are left out, as
+# they are read in every window of letters and aren't hidden in their own right.
+def get_hidden_words(letters, trie, min_length=config.min_hidden_word_length):
+    spans = list(trie.iter_words(letters, min_length))
+    return [(start, letters[start:end]) for start, end in spans
+            if not any([other_start <= start and end <= other_end and other_end - other_start > end - start
+                        for other_start, other_end in spans])]
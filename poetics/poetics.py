@@ -1,25 +1,48 @@
+import json
 import logging
+import multiprocessing
 import os
+import queue
 import re
+import time
+import traceback
+from collections import deque
+from contextlib import nullcontext
+from functools import partial
 
 from poetics import config as config
+from poetics.classes.exporter import Exporter
+from poetics.classes.manifest import Manifest
+from poetics.classes.metrics import Metrics
 from poetics.classes.poem import Poem
+from poetics.classes.profiler import Profiler
+from poetics.classes.record_writer import RecordWriter
+from poetics.classes.rhyme_index import RhymeIndex
+from poetics.logging import print_metrics
 
 
 def create_poem(filename, title=None, author=None, directory=config.poem_directory):
     with open(directory + '/' + filename, encoding="utf-8") as data:
         read_data = data.readlines()
 
+    title, author = get_title_and_author(filename, title, author)
+    return Poem(read_data, title, author)
+
+
+# Returns (title, author) for a poem file, detected from filename where title or author aren't provided.
+def get_title_and_author(filename, title=None, author=None):
     if not title:
         # If the file is in a directory name the poem the entire name of the text file (minus .txt).
         if '/' in filename or '\\' in filename:
-            title = re.search(r"(?<=[\\/])[^\\/]+(?=\.txt)", filename).group(0)
+            match = re.search(r"(?<=[\\/])[^\\/]+(?=\.txt)", filename)
+            title = match.group(0) if match else None
             if not title:
                 title = "Unknown poem"
                 logging.warning("Title for \"%s\" set as \"Unknown poem\". Title detection failed.", filename)
         # Otherwise, assume that the file is named <title>-<author>.txt.
         else:
-            title = re.search(".+(?=-)", filename).group(0)
+            match = re.search(".+(?=-)", filename)
+            title = match.group(0) if match else None
             if not title:
                 title = "Unknown poem"
                 logging.warning("Title for \"%s\" set as \"Unknown poem\". Please format filenames as "
@@ -30,23 +53,196 @@ def create_poem(filename, title=None, author=None, directory=config.poem_directo
         # If the file is in a directory, use the name of the highest level subdirectory of the poems directory as the
         # author name.
         if '/' in filename or '\\' in filename:
-            author = re.search(r"[^\\/]+", filename).group(0)
+            match = re.search(r"[^\\/]+", filename)
+            author = match.group(0) if match else None
             if not author:
                 author = "Unknown Poet"
                 logging.warning("Author for \"%s\" set as \"Unknown poet\". Author detection failed.", filename)
         # Otherwise, assume that the file is named <title>-<author>.txt.
         else:
-            author = re.search("(?<=-).+(?=\.txt)", filename).group(0)
+            match = re.search("(?<=-).+(?=\.txt)", filename)
+            author = match.group(0) if match else None
             if not author:
                 author = "Unknown Poet"
                 logging.warning("Author for \"%s\" set as \"Unknown poet\". Please format filenames as "
                                 "\"title-author.txt\" for author name detection for poems inside of the root poems "
                                 "directory, or provide the author's name. as an argument to create_poem().", filename)
 
-    return Poem(read_data, title, author)
+    return title, author
+
+
+# Creates a poem from a file and runs the analyses named in outputs (see config.poem_outputs) on it, in order.
+def analyze_poem(filename, directory=config.poem_directory, outputs=config.default_outputs):
+    poem = create_poem(filename, directory=directory)
+    run_outputs(poem, outputs)
+    return poem
+
+
+# Runs the analyses named in outputs (see config.poem_outputs) on a poem, in order.
+def run_outputs(poem, outputs=config.default_outputs):
+    for output in outputs:
+        if output in config.poem_outputs:
+            getattr(poem, config.poem_outputs[output])()
+        else:
+            logging.warning("Unknown output \"%s\". Valid outputs are: %s.", output, ', '.join(config.poem_outputs))
+
+
+# Creates a poem from text (a string) and runs the analyses named in outputs on it, as analyze_poem does. If as_record is
+# True, a dictionary of the poem's record is returned instead of the poem.
+def analyze_text(text, title='Unknown Poem', author='Unknown', outputs=config.default_outputs, as_record=False):
+    poem = Poem(text.splitlines(True), title, author)
+    run_outputs(poem, outputs)
+    if as_record:
+        return dict(zip(config.record_headers, poem.get_record()))
+    return poem
+
+
+# Analyzes a poem as analyze_poem does, but catches any error so that one bad file can't stop a batch. Returns
+# (filename, poem, None) on success, or (filename, None, traceback) on failure. If as_record is True, a dictionary of
+# the poem's record (see Poem.get_record) is returned in place of the poem, which is much cheaper to pass between
+# processes. If profile is True, the analysis is profiled (see Profiler.run) and the profile is added to the end of the
+# returned tuple.
+def analyze_poem_safely(filename, directory=config.poem_directory, outputs=config.default_outputs, as_record=False,
+                        profile=False):
+    if profile:
+        result, profile = Profiler().run(analyze_poem_safely, filename, directory, outputs, as_record)
+        return result + (profile,)
+    try:
+        poem = analyze_poem(filename, directory, outputs)
+        if as_record:
+            return filename, dict(zip(config.record_headers, poem.get_record())), None
+        return filename, poem, None
+    except Exception:
+        return filename, None, traceback.format_exc()
+
+
+# Returns the paths (relative to directory) of all files in directory and its subdirectories, sorted so that poems are
+# always processed and recorded in the same order.
+def get_poem_files(directory=config.poem_directory):
+    files = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        relative_path = os.path.relpath(dirpath, directory)
+        for filename in filenames:
+            # Handles root directory
+            if relative_path == ".":
+                files.append(filename)
+            else:
+                files.append(os.path.join(relative_path, filename))
+    return sorted(files)
+
+
+# Prepares a worker process. The spaCy model and lexicon are loaded when poetics.config is imported, so forked workers
+# inherit them copy-on-write and spawned workers load them once on import, rather than once per poem. Running the model
+# once here finishes any lazy initialization before the first poem arrives. collect_metrics, if given, sets
+# config.collect_metrics in the worker (which spawned workers wouldn't otherwise inherit).
+def init_worker(collect_metrics=None):
+    if collect_metrics is not None:
+        config.collect_metrics = collect_metrics
+    config.spacy_model("Warm up.")
+
+
+# Returns the multiprocessing context to start workers with. Fork is preferred (where available) so that workers share
+# the parent's loaded models.
+def get_worker_context():
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
 
+# Yields (filename, poem, traceback) for files (relative to directory), where poem is None and traceback is set for
+# files that failed to be analyzed (see analyze_poem_safely for outputs and as_record). If jobs is more than 1, poems are
+# analyzed by a pool of that many worker processes. Files are handed out one at a time as workers become free, so a
+# worker that draws long poems doesn't hold up the others. No more than max_pending files (by default
+# config.pending_per_job per worker) are queued or waiting to be consumed at once, so a slow consumer holds back analysis
+# rather than letting results pile up in memory. Results are yielded in the order of files if ordered is True, or as
+# they complete otherwise. If profile is True, each poem is profiled in its worker and results are yielded as
+# (filename, poem, traceback, profile), where profile (None if the worker failed) can be added to a Profiler.
+def analyze_poems(files, directory=config.poem_directory, jobs=None, outputs=config.default_outputs, as_record=False,
+                  ordered=True, max_pending=None, profile=False):
+    analyze = partial(analyze_poem_safely, directory=directory, outputs=outputs, as_record=as_record, profile=profile)
 
-def process_poems(directory=config.poem_directory, outputfile=config.output_file):
+    # Returns the result of a file whose analysis couldn't be returned from its worker.
+    def failed(file, error):
+        return (file, None, error, None) if profile else (file, None, error)
+
+    if not jobs or jobs < 2:
+        for file in files:
+            yield analyze(file)
+        return
+    max_pending = max_pending or jobs * config.pending_per_job
+    files = iter(files)
+    # Leaving the pool (including when the consumer stops early) terminates its workers.
+    with get_worker_context().Pool(jobs, initializer=init_worker, initargs=(config.collect_metrics,)) as pool:
+        # Submitted files and their results in order of submission, and (for unordered results only) results in order
+        # of completion. For unordered results, only the number of submitted files matters.
+        pending = deque()
+        completed = queue.Queue()
+
+        # Submits the next file, returning False if there are none left. Results that can't be returned from a worker
+        # (e.g. that fail to pickle) are reported as failures of their file. Ordered results are only taken from
+        # pending, so they aren't also queued in completed, where nothing would ever take them.
+        def submit():
+            file = next(files, None)
+            if file is None:
+                return False
+            if ordered:
+                result = pool.apply_async(analyze, (file,))
+            else:
+                result = pool.apply_async(analyze, (file,), callback=completed.put,
+                                          error_callback=lambda error: completed.put(failed(file, repr(error))))
+            pending.append((file, result))
+            return True
+
+        while len(pending) < max_pending and submit():
+            pass
+        while pending:
+            if ordered:
+                file, result = pending.popleft()
+                try:
+                    result = result.get()
+                except Exception:
+                    result = failed(file, traceback.format_exc())
+            else:
+                result = completed.get()
+                pending.pop()
+            submit()
+            yield result
+
+
+# Yields analyzed poems for all poems in a directory (including its subdirectories), running the analyses named in
+# outputs (see config.poem_outputs) on each. If as_record is True, dictionaries of each poem's record are yielded instead
+# of poems. Poems that fail to be analyzed are logged and skipped. jobs, ordered and max_pending are as for
+# analyze_poems: poems are analyzed by a pool of jobs workers, yielded in order or as they complete, and analysis waits
+# for the consumer once max_pending results are outstanding.
+def iter_poems(directory=config.poem_directory, outputs=config.default_outputs, jobs=None, as_record=False,
+               ordered=True, max_pending=None):
+    if not os.path.isdir(directory):
+        logging.warning("\"%s\" is not a valid directory.", directory)
+        return
+    for file, poem, error in analyze_poems(get_poem_files(directory), directory, jobs, outputs, as_record, ordered,
+                                           max_pending):
+        if error:
+            logging.error("Failed to analyze \"%s\".\n%s", file, error)
+        else:
+            yield poem
+
+
+# Analyzes all poems in a directory and records them to outputfile. If rhyme_index_file is provided, the line-final
+# rhymes of each poem are also added to the corpus rhyme index stored in that file. If jobs is more than 1, poems are
+# analyzed by that many worker processes, and are recorded in the same order as they would be by a single process. If
+# export_path is provided, every analysis result is also exported there in export_format (see Exporter). If incremental
+# is True, a manifest of the files analyzed is kept next to outputfile, and only new or modified files are analyzed; the
+# stored results of modified and removed files are replaced or dropped. Files whose results were stored in a different
+# export or rhyme index are analyzed again. Incremental runs also checkpoint their progress every
+# config.checkpoint_interval poems, so an interrupted run resumes after the last checkpoint. Files that fail to be
+# analyzed are skipped (until they are modified) and their tracebacks are written to an error report next to outputfile.
+# outputs names the analyses run on each poem (see config.poem_outputs). If config.collect_metrics is set, the metrics
+# of all poems analyzed are added up, logged, written next to outputfile and returned. If profile_path is provided, each
+# poem is profiled in its worker, and the profiles of all poems are merged and written to profile_path (see
+# Profiler.dump).
+def process_poems(directory=config.poem_directory, outputfile=config.output_file, rhyme_index_file=None, jobs=None,
+                  export_path=None, export_format=config.export_format, incremental=True,
+                  outputs=config.default_outputs, profile_path=None):
     # Does the provided directory exist?
     if not os.path.isdir(directory):
         logging.warning("\"%s\" is not a valid directory.", directory)
@@ -56,19 +252,126 @@ def process_poems(directory=config.poem_directory, outputfile=config.output_file
         logging.warning("Directory \"%s\" contains no files.", directory)
         return None
 
-    for dirpath, dirnames, filenames in os.walk(directory):
-        relative_path = os.path.relpath(dirpath, directory)
-        for filename in filenames:
-            # Handles root directory
-            if relative_path == ".":
-                file = filename
-            else:
-                file = os.path.join(relative_path, filename)
-            poem = create_poem(file)
-            poem.get_rhymes()
-            poem.get_sonic_features()
-            poem.get_pos()
-            poem.get_scansion()
-            poem.get_meter()
-            poem.get_form()
-            poem.record(outputfile)
+    files = get_poem_files(directory)
+    # Where results are stored besides outputfile. Files whose results were stored elsewhere are re-analyzed.
+    sinks = {'export': [os.path.abspath(export_path), export_format] if export_path else None,
+             'rhyme_index': os.path.abspath(rhyme_index_file) if rhyme_index_file else None}
+    # The manifest entries of files that have changed or been removed since the last run, whose results are stale.
+    stale = {}
+    manifest = None
+    if incremental:
+        manifest = Manifest(os.path.splitext(outputfile)[0] + '.manifest.json')
+        changed, removed = manifest.check(files, directory, sinks)
+        stale = {file: manifest.remove(file) for file in changed + removed if file in manifest.entries}
+        logging.info("%s of %s poems are new or modified, %s removed.", len(changed), len(files), len(removed))
+        files = changed
+
+    rhyme_index = RhymeIndex(rhyme_index_file) if rhyme_index_file else None
+    error_report = os.path.splitext(outputfile)[0] + '.errors.jsonl'
+    failures = 0
+    metrics = Metrics(poems=0) if config.collect_metrics else None
+    profiler = Profiler() if profile_path else None
+
+    # Records are written by this process alone, in batches, however many workers are analyzing poems. Leaving the block
+    # (including on an error or interrupt) writes out and closes both the records and the export. Incremental runs only
+    # write out results at checkpoints, so that nothing is written for a file until the manifest is saved with it.
+    batch_size = None if manifest else config.record_batch_size
+    with RecordWriter(outputfile, batch_size, config.batch_record_headers) as writer, \
+            (Exporter(export_path, export_format, None if manifest else config.export_batch_size)
+             if export_path else nullcontext()) as exporter:
+        if stale:
+            # Results are removed by file, and only from the sinks they were stored in (entries written before sinks
+            # were recorded are assumed to have used the current ones). Files that failed may still have stored some
+            # results before failing, so their entries are included.
+            writer.remove_records(set(stale), set([(entry['title'], entry['author']) for entry in stale.values()]))
+            if rhyme_index:
+                for file, entry in stale.items():
+                    if (entry.get('sinks') or sinks)['rhyme_index'] == sinks['rhyme_index']:
+                        rhyme_index.remove_poem(entry['title'], entry['author'], file)
+            if exporter:
+                exporter.remove_poems([entry['poem_id'] for entry in stale.values() if entry['poem_id'] is not None
+                                       and (entry.get('sinks') or sinks)['export'] == sinks['export']])
+        try:
+            for count, (file, poem, error, *profile) in enumerate(analyze_poems(files, directory, jobs, outputs,
+                                                                                profile=bool(profiler)), 1):
+                if profiler and profile[0]:
+                    profiler.add(file, profile[0])
+                if poem:
+                    # Everything stored for the poem is made (and its manifest entry updated) before any of it is
+                    # written, so a poem that fails at any step leaves nothing in the output, rhyme index or export.
+                    try:
+                        record = poem.get_record() + [file]
+                        rhymes = rhyme_index.get_entries(poem, file) if rhyme_index else None
+                        poem_id, rows = exporter.get_rows(poem) if exporter else (None, None)
+                        if manifest:
+                            manifest.update(file, directory, poem.title, poem.author, poem_id, sinks)
+                    except Exception:
+                        error = traceback.format_exc()
+                    else:
+                        writer.write_row(record)
+                        logging.info("Data for \"%s\" queued for %s", poem.title, outputfile)
+                        if rhyme_index:
+                            rhyme_index.add_entries(rhymes)
+                        if exporter:
+                            exporter.add_rows(poem_id, rows)
+                        if metrics and poem.metrics:
+                            metrics.add(poem.metrics)
+                if error:
+                    failures += 1
+                    report_failure(error_report, file, error)
+                    if manifest:
+                        manifest.update(file, directory, sinks=sinks, error=True)
+                # Checkpoint: write out everything recorded so far, then the manifest, so that the manifest never lists
+                # a file whose results haven't been written.
+                if manifest and count % config.checkpoint_interval == 0:
+                    writer.flush()
+                    if exporter:
+                        exporter.flush()
+                    if rhyme_index:
+                        rhyme_index.save()
+                    manifest.save()
+        except BaseException:
+            # The results of files since the last checkpoint aren't in the saved manifest, so they're dropped rather than
+            # written (along with the rhyme index, which is only saved at checkpoints). Resuming analyzes them again.
+            if manifest:
+                writer.discard()
+                if exporter:
+                    exporter.discard()
+            raise
+
+    if rhyme_index:
+        rhyme_index.save()
+    if manifest:
+        manifest.save()
+    if failures:
+        logging.warning("%s poems failed to be analyzed. See %s for details.", failures, error_report)
+    if profiler:
+        profiler.dump(profile_path)
+        logging.info("Profile written to %s. Slowest poems: %s", profile_path,
+                     ', '.join(['%s (%.2fs)' % item for item in profiler.get_slowest(5)]))
+    if metrics:
+        print_metrics(metrics)
+        write_metrics(os.path.splitext(outputfile)[0] + '.metrics.json', metrics)
+    return metrics
+
+
+# Appends a failure (the file that failed and its traceback) to the error report at report_path, as a line of json.
+def report_failure(report_path, filename, error):
+    logging.error("Failed to analyze \"%s\".\n%s", filename, error)
+    try:
+        with open(report_path, 'a', encoding="utf-8") as file:
+            file.write(json.dumps({'file': filename, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'traceback': error})
+                       + '\n')
+    except IOError as error:
+        logging.exception("Failed to write error report. %s for file %s [Error Number %s].", error.strerror,
+                          error.filename, error.errno, exc_info=False)
+
+
+# Writes metrics (see Metrics) to path as json.
+def write_metrics(path, metrics):
+    try:
+        with open(path, 'w', encoding="utf-8") as file:
+            json.dump(metrics.as_dict(), file, indent=1)
+    except IOError as error:
+        logging.exception("Failed to write metrics. %s for file %s [Error Number %s].", error.strerror,
+                          error.filename, error.errno, exc_info=False)
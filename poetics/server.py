@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from poetics import config as config
+from poetics.classes.parse_batcher import ParseBatcher
+from poetics.classes.poem import Poem
+from poetics.conversions import poem_to_rows
+from poetics.lookups import get_word_trie, load_rhyme_index
+from poetics.poetics import init_worker, run_outputs
+
+# Batches the sentences of concurrent requests into shared spaCy passes. Created by serve.
+batcher = None
+# Request counts and recent latencies, shared by all request threads.
+stats = {'started': None, 'requests': 0, 'errors': 0, 'latencies': deque(maxlen=config.server_latency_window)}
+stats_lock = threading.Lock()
+
+
+########################################################################################################################
+# Server
+########################################################################################################################
+# Analyzes a request ({'text', 'title', 'author', 'outputs'}), returning the poem's rows for each export table (see
+# config.export_tables) as {table: [{column: value}]}.
+def handle_analyze(request):
+    poem = Poem(request['text'].splitlines(True), request.get('title') or 'Unknown Poem',
+                request.get('author') or 'Unknown')
+    outputs = request.get('outputs') or config.default_outputs
+    # Parts of speech are got first, through the batcher, so that no later stage parses on its own.
+    if [output for output in outputs if output in ['pos', 'scansion', 'meter', 'form']]:
+        if batcher:
+            poem.get_pos(batcher.parse)
+        else:
+            poem.get_pos()
+    run_outputs(poem, [output for output in outputs if output != 'pos'])
+    tables = {table: [] for table in config.export_tables}
+    for table, row in poem_to_rows(poem, 0):
+        tables[table].append(dict(zip(config.export_tables[table], row)))
+    return tables
+
+
+# Returns an error message for an analyze request that can't be run (text isn't a string, title or author isn't a
+# string, or outputs isn't a list of names from config.poem_outputs), or None if it can.
+def check_analyze(request):
+    if not isinstance(request.get('text'), str):
+        return '"text" must be a string.'
+    for key in ['title', 'author']:
+        if request.get(key) is not None and not isinstance(request[key], str):
+            return '"%s" must be a string.' % key
+    outputs = request.get('outputs')
+    if outputs is not None and not (isinstance(outputs, list) and all([isinstance(output, str) and
+                                                                       output in config.poem_outputs
+                                                                       for output in outputs])):
+        return '"outputs" must be a list of: %s.' % ', '.join(config.poem_outputs)
+    return None
+
+
+# Returns the server's health and stats: uptime, request and error counts, recent latencies (in milliseconds) and the
+# number of parse batches.
+def handle_health():
+    with stats_lock:
+        latencies = sorted(stats['latencies'])
+        requests, errors = stats['requests'], stats['errors']
+    latency = {}
+    if latencies:
+        latency = {'mean': round(sum(latencies) / len(latencies), 2),
+                   'p50': latencies[len(latencies) // 2],
+                   'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                   'max': latencies[-1]}
+    return {'status': 'ok', 'uptime': round(time.time() - stats['started'], 1), 'requests': requests,
+            'errors': errors, 'latency_ms': latency, 'parse_batches': batcher.batches if batcher else 0,
+            'parsed_texts': batcher.texts if batcher else 0}
+
+
+# Handles a request ({'op': 'analyze' or 'health', ...}) from either server, returning (status code, response).
+def handle(request):
+    if not isinstance(request, dict):
+        return 400, {'error': 'Request must be a JSON object.'}
+    start = time.perf_counter()
+    op = request.get('op', 'analyze')
+    try:
+        if op == 'health':
+            return 200, handle_health()
+        elif op == 'analyze':
+            error = check_analyze(request)
+            if error:
+                return 400, {'error': error}
+            response = handle_analyze(request)
+        else:
+            return 400, {'error': 'Unknown op "%s".' % op}
+    except Exception as error:
+        logging.exception("Failed to handle request.")
+        with stats_lock:
+            stats['errors'] += 1
+        return 500, {'error': repr(error)}
+    with stats_lock:
+        stats['requests'] += 1
+        stats['latencies'].append(round((time.perf_counter() - start) * 1000, 2))
+    return 200, response
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    # GET /health returns health and stats. POST /analyze analyzes the JSON request body.
+    def do_GET(self):
+        if self.path.rstrip('/') == '/health':
+            self.respond(*handle({'op': 'health'}))
+        else:
+            self.respond(404, {'error': 'Not found.'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/analyze':
+            self.respond(404, {'error': 'Not found.'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            self.respond(400, {'error': 'Request body must be JSON.'})
+            return
+        if isinstance(request, dict):
+            request['op'] = 'analyze'
+        self.respond(*handle(request))
+
+    def respond(self, status, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Requests are counted in stats rather than logged.
+    def log_message(self, format, *args):
+        return
+
+
+class SocketHandler(socketserver.StreamRequestHandler):
+    # Each line received is a JSON request, and is answered with a line of JSON.
+    def handle(self):
+        for line in self.rfile:
+            try:
+                status, response = handle(json.loads(line))
+            except ValueError:
+                response = {'error': 'Request must be JSON.'}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# Preloads all resources, then serves analysis requests over http on host:port, and over a Unix socket at socket_path
+# if one is given, until interrupted.
+def serve(host=config.server_host, port=config.server_port, socket_path=config.server_socket):
+    global batcher
+    init_worker()
+    load_rhyme_index()
+    get_word_trie()
+    batcher = ParseBatcher()
+    stats['started'] = time.time()
+
+    unix_server = None
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        unix_server = ThreadingUnixServer(socket_path, SocketHandler)
+        threading.Thread(target=unix_server.serve_forever, daemon=True).start()
+        logging.info("Serving on %s", socket_path)
+    http_server = ThreadingHTTPServer((host, port), HTTPHandler)
+    http_server.daemon_threads = True
+    logging.info("Serving on http://%s:%s", host, port)
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        if unix_server:
+            unix_server.server_close()
+            os.remove(socket_path)
+
+
+########################################################################################################################
+# Client
+########################################################################################################################
+# Sends a request ({'op': ..., ...}) to a running server, over its Unix socket if socket_path is given and http
+# otherwise, and returns the response.
+def request_server(request, host=config.server_host, port=config.server_port, socket_path=config.server_socket):
+    if socket_path:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+            client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            with client.makefile('rb') as file:
+                return json.loads(file.readline())
+    if request.get('op') == 'health':
+        with urllib.request.urlopen('http://%s:%s/health' % (host, port)) as response:
+            return json.loads(response.read())
+    http_request = urllib.request.Request('http://%s:%s/analyze' % (host, port), json.dumps(request).encode('utf-8'),
+                                          {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(http_request) as response:
+        return json.loads(response.read())
+
+
+# Analyzes text on a running server, returning its rows for each export table as {table: [{column: value}]}.
+def analyze_remote(text, outputs=None, title=None, author=None, host=config.server_host, port=config.server_port,
+                   socket_path=config.server_socket):
+    return request_server({'op': 'analyze', 'text': text, 'outputs': outputs, 'title': title, 'author': author},
+                          host, port, socket_path)
+
+
+if __name__ == "__main__":
+    serve()
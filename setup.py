@@ -7,5 +7,7 @@ setup(name='poetics',
       author='Max Epstein',
       author_email='x@x.com',
       license='MIT',
-      packages=['poetics'],
+      packages=['poetics', 'poetics.classes'],
+      python_requires='>=3.9',
+      entry_points={'console_scripts': ['poetics=poetics.cli:main']},
       zip_safe=False)
\ No newline at end of file